@@ -1,5 +1,7 @@
 import streamlit as st
 import utils
+import db
+import quota
 # Viewsフォルダから各機能をインポート
 from views import public, member, admin
 
@@ -34,6 +36,29 @@ def show_footer():
         unsafe_allow_html=True
     )
 
+def show_data_status():
+    """ 表示中のデータがどれくらい古いか (サイドバー用) """
+    age, err = db.data_status()
+    if age is None: return
+    if isinstance(err, quota.Throttled):
+        st.caption(f"⏳ アクセスが集中しています（{int(age)}秒前のデータを表示中）")
+    elif err:
+        st.caption(f"⚠️ 最新データを取得できません（{int(age)}秒前のデータを表示中）")
+    elif age >= 60:
+        st.caption(f"🕒 データ更新: {int(age // 60)}分前")
+    else:
+        st.caption(f"🕒 データ更新: {int(age)}秒前")
+    
+    # 書き込みキューの状態 (このセッションで保存したもの)
+    waiting, failed = db.write_status()
+    if waiting:
+        st.caption(f"⏳ 保存を反映中: {waiting}件")
+    if failed:
+        st.caption(f"⚠️ 保存に失敗: {len(failed)}件（{failed[-1].error}）")
+        if st.button("もう一度保存する", key="retry_writes_btn"):
+            db.retry_failed_writes()
+            st.rerun()
+
 # --- 🚀 メイン処理 ---
 user = st.session_state.user_info
 
@@ -50,6 +75,7 @@ if user is None:
             ["Top", "Members", "Result", "Blog", "OBOG", "Link", "Login"], 
             key="public_menu_radio"
         )
+        show_data_status()
     
     # ページ表示
     if menu == "Top": public.page_home()
@@ -101,6 +127,7 @@ else:
         if st.button("Logout", key="logout_btn"):
             st.session_state.user_info = None
             st.rerun()
+        show_data_status()
 
     # ページ表示の振り分け (日本語メニューに対応)
     if sel == "ダッシュボード": member.page_top()
@@ -0,0 +1,137 @@
+import streamlit as st
+import json
+import os
+import pandas as pd
+from datetime import datetime
+import storage
+
+# ==========================================
+# 締めた年度のアーカイブ (ローカルの列指向ファイル)
+# ==========================================
+# 過去の年度の行はシートから外し、年度ごとの Parquet ファイル (zstd 圧縮) に固めておく。
+# どの年度がどのファイルにあるかは manifest.json に記録する。
+# シートには今の年度だけが残るので毎回の読み込みが小さくなり、過去の分はネットワークを使わずに読める。
+# ファイルにはシートの値 (文字列) をそのまま入れるので、読み戻すとシートから読んだのと同じ形になる。
+# (アーカイブのディレクトリはアプリと一緒に配置すること)
+MANIFEST = "manifest.json"
+
+
+def archive_dir():
+    """
+    secrets.toml の [storage] archive_dir または環境変数 TF_ARCHIVE_DIR (既定: archive)
+    """
+    conf = {}
+    try: conf = dict(st.secrets.get("storage", {}))
+    except Exception: pass # secrets.toml が無い (テスト・CLI) 場合
+    return os.environ.get("TF_ARCHIVE_DIR") or conf.get("archive_dir", "archive")
+
+
+def _manifest_path(directory):
+    return os.path.join(directory, MANIFEST)
+
+
+def read_manifest(directory=None):
+    """ {テーブル: {年度(文字列): {"file", "rows", "header", "frozen_at"}}} """
+    try:
+        with open(_manifest_path(directory or archive_dir()), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_atomic(path, write):
+    """ 一時ファイルに書いてから置き換える (途中で失敗しても前のファイルが残る) """
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def stamp(directory=None):
+    """ マニフェストの更新時刻 (キャッシュキー用)。アーカイブが無ければ None """
+    try: return os.stat(_manifest_path(directory or archive_dir())).st_mtime_ns
+    except FileNotFoundError: return None
+
+
+def seasons(table, directory=None):
+    """ アーカイブ済みの年度 (古い順) """
+    return sorted(int(s) for s in read_manifest(directory).get(table, {}))
+
+
+def _read_values(path):
+    """ Parquet ファイル -> ヘッダー行つきの2次元リスト (文字列) """
+    df = pd.read_parquet(path)
+    return [list(df.columns)] + df.fillna("").astype(str).values.tolist()
+
+
+def read_season(table, season, directory=None):
+    """ アーカイブ済みの年度 season の行 (ヘッダー行つきの2次元リスト)。マニフェストに無ければ FileNotFoundError """
+    directory = directory or archive_dir()
+    entry = read_manifest(directory).get(table, {}).get(str(season))
+    if not entry: raise FileNotFoundError(f"{table} の {season}年度はアーカイブにありません")
+    return _read_values(os.path.join(directory, entry["file"]))
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _records(directory, table, version):
+    manifest = read_manifest(directory)
+    records = []
+    for season in sorted(manifest.get(table, {}), key=int):
+        records += storage.to_records(_read_values(os.path.join(directory, manifest[table][season]["file"])))
+    return tuple(records)
+
+
+def records(table, directory=None):
+    """
+    アーカイブ済みの全年度の行 (get_records と同じ形、古い年度から順)。
+    マニフェストが変わるまで読み直さない。共有のタプルなので書き換えないこと
+    """
+    directory = directory or archive_dir()
+    s = stamp(directory)
+    if s is None: return ()
+    return _records(directory, table, s)
+
+
+def freeze(table, season, header, rows, key=None, directory=None):
+    """
+    年度 season の行 (シートの値のまま) をアーカイブに書き込む。
+    既にその年度のファイルがあれば足し合わせ、key (行の辞書 -> キー) が同じ行は後のものを残す。
+    ファイルを書いてからマニフェストを更新する。アーカイブに入った行数を返す
+    """
+    directory = directory or archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    entry = manifest.get(table, {}).get(str(season))
+    name = f"{table}_{season}.parquet"
+    path = os.path.join(directory, name)
+
+    header = list(header)
+    rows = [[str(v) for v in r] for r in rows]
+    if entry:
+        old = _read_values(os.path.join(directory, entry["file"]))
+        merged = list(old[0]) + [c for c in header if c not in old[0]]
+        pos = [header.index(c) if c in header else None for c in merged]
+        old_rows = [list(r) + [""] * (len(merged) - len(r)) for r in old[1:]]
+        new_rows = [[r[i] if i is not None and i < len(r) else "" for i in pos] for r in rows]
+        header, rows = merged, old_rows + new_rows
+    rows = [(list(r) + [""] * len(header))[:len(header)] for r in rows]
+
+    if key:
+        last = {}
+        for i, rec in enumerate(storage.to_records([header] + rows)):
+            last[key(rec)] = i
+        rows = [rows[i] for i in sorted(last.values())]
+
+    df = pd.DataFrame(rows, columns=header, dtype=str)
+    _write_atomic(path, lambda p: df.to_parquet(p, compression="zstd", index=False))
+
+    manifest.setdefault(table, {})[str(season)] = {
+        "file": name,
+        "rows": len(rows),
+        "header": header,
+        "frozen_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    def write_manifest(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+    _write_atomic(_manifest_path(directory), write_manifest)
+    return len(rows)
@@ -0,0 +1,146 @@
+import threading
+import time
+import quota
+
+# ==========================================
+# シングルフライト (同時リクエストの相乗り)
+# ==========================================
+# 同じデータの取得が実行中なら、新しく取りに行かずにその結果を待って共有する。
+# 大会当日に大勢が同時に開いても、シートへのリクエストは1回で済む。
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """ key の取得を実行する。実行中のものがあればその結果 (か例外) を受け取る """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None: raise call.error
+            return call.value
+        try:
+            call.value = fn()
+            return call.value
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+# ==========================================
+# Stale-While-Revalidate キャッシュ
+# ==========================================
+# 読み込みは常に手元の最新コピーから即答し、コピーが soft_ttl より古くなったら
+# 裏のスレッドで取り直す。hard_ttl を超えたコピーは使わず、取り直しを待つ。
+
+
+class SWRCache:
+    def __init__(self, loader, soft_ttl, hard_ttl):
+        self.loader = loader
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded_at = 0.0   # 今のコピーを取得した時刻
+        self._stale_at = 0.0    # 最後に invalidate() された時刻
+        self._refreshing = None # 裏で取り直し中のスレッド
+        self._flight = SingleFlight()
+        self._failed_at = 0.0   # 直近の失敗時刻 (失敗が続くときに連打しない)
+        self.last_error = None
+
+    def get(self, min_loaded_at=0.0):
+        """
+        値を返す。min_loaded_at より前に取得したコピーしか無い場合は
+        (書き込んだ本人が自分の変更を見られるように) 取り直しを待つ。
+        """
+        now = time.time()
+        with self._lock:
+            value, loaded_at = self._value, self._loaded_at
+            has_value = loaded_at > 0
+            usable = has_value and now - loaded_at < self.hard_ttl and loaded_at >= min_loaded_at
+            if usable:
+                if (self._stale_at > loaded_at or now - loaded_at > self.soft_ttl) and now - self._failed_at > self.soft_ttl:
+                    self._start_refresh()
+                return value
+        # 使えるコピーが無いので、取り直しを待つ
+        return self._load_now(min_loaded_at)
+
+    def _start_refresh(self):
+        """ 裏で取り直す (ロックを持って呼ぶこと。同時に走るのは1本だけ) """
+        if self._refreshing and self._refreshing.is_alive(): return
+        self._refreshing = threading.Thread(target=self._refresh, name="swr-refresh", daemon=True)
+        self._refreshing.start()
+
+    def _load(self):
+        """ 取得して保存する。同時に呼ばれたら1回の取得に相乗りする。(値, 取得開始時刻) を返す """
+        def run():
+            started = time.time()
+            value = self.loader()
+            self._store(value, started)
+            return value, started
+        return self._flight.do("load", run)
+
+    def _refresh(self):
+        try:
+            # 裏の取り直しは画面の読み込みより後回しでよい
+            with quota.background():
+                self._load()
+        except Exception as e:
+            # 失敗しても手元のコピーで答え続ける
+            self._failed(e)
+
+    def _failed(self, e):
+        with self._lock:
+            self.last_error = e
+            self._failed_at = time.time()
+
+    def _load_now(self, min_loaded_at):
+        # 実行中の取得 (裏の取り直しを含む) があれば相乗りする。
+        # ただしそれが min_loaded_at より前に始まったものなら、終わるのを待ってから取り直す
+        while True:
+            try: value, started = self._load()
+            except Exception as e:
+                self._failed(e)
+                raise
+            if started >= min_loaded_at: return value
+
+    def _store(self, value, loaded_at):
+        """ loaded_at は取得を「始めた」時刻 (それ以前の書き込みは必ず含まれている) """
+        with self._lock:
+            if loaded_at < self._loaded_at: return # もっと新しいコピーが既にある
+            self._value = value
+            self._loaded_at = loaded_at
+            self.last_error = None
+            self._failed_at = 0.0
+
+    def invalidate(self):
+        """ 次の読み込みで取り直す (それまでは古いコピーで答える) """
+        with self._lock:
+            self._stale_at = time.time()
+
+    def latest(self):
+        """ 古さを問わず、手元にある最新のコピー (まだ無ければ None) """
+        with self._lock:
+            return self._value if self._loaded_at else None
+
+    def age(self):
+        """ 今のコピーの経過秒数 (まだ無ければ None) """
+        with self._lock:
+            return time.time() - self._loaded_at if self._loaded_at else None
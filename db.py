@@ -1,42 +1,379 @@
 import streamlit as st
 import json
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import datetime
+import time
 import uuid
-import utils 
-
-SPREADSHEET_KEY = "156ClxCEF8kOhLIOOqTw_qX1g58sLq9Q5qBYfpF9B5Wg"
+import contextlib
+import dataclasses
+from types import MappingProxyType
+import utils
+import storage
+import cache
+import results_index
+import archive
+import write_queue
+import quota
+from write_queue import Write
 
 # --- 接続 ---
-def get_gspread_client():
+# 読み書きは storage のバックエンド (スプレッドシート / SQLite) 経由で行う。
+# どちらを使うかは secrets.toml の [storage] か環境変数 TF_STORAGE で切り替える。
+def get_storage():
+    return storage.get_storage()
+
+def _handle_error(e):
+    """ 通信・認証系のエラーなら接続を作り直す """
+    store = get_storage()
+    if hasattr(store, "handle_error"): store.handle_error(e)
+
+# --- スナップショット ---
+# アプリが使う全シートを1回のまとめ取り (batchGet) で読み込み、同じ時点のデータとして共有する。
+# 各 load_* はこのスナップショットから作り、読むテーブルの世代 (Snapshot.generation) ごとにキャッシュする。
+# 取り直してもそのテーブルの中身が変わっていなければ世代は同じなので、作り直さない
+# (例: 部員を保存しても、大会の一覧やエントリーの索引は作り直さない)。
+# 読み込みは常に手元のコピーから即答し、古くなったら裏で取り直す (stale-while-revalidate)。
+SNAPSHOT_SOFT_TTL = 3    # これより古ければ裏で取り直す (秒)
+SNAPSHOT_HARD_TTL = 300  # これより古いコピーは使わず、取り直しを待つ (秒)
+
+def _fetch_snapshot():
+    snap = _with_archive(get_storage().get_snapshot())
+    # 前回と中身が同じテーブルは世代を引き継ぐ
+    return storage.Snapshot.build(snap.tables, snap.fetched_at, previous=_snapshot_cache().latest(), archived=snap.archived)
+
+# --- 締めた年度のリザルト ---
+# 過去の年度のリザルトはシートから外してローカルのアーカイブ (archive.py) に移してある。
+# スナップショットの results はアーカイブの行 + シートの行 (今の年度) にしておき、
+# ランキング・選手の記録・期間内ベストなどは両方を区別せずに読む。
+def _record_key(rec):
+    """ 読み込み済みの行の RESULTS_KEY (_result_key と同じだが数値化はしない) """
+    return tuple(str(rec.get(k, "")) for k in RESULTS_KEY)
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _archived_results(stamp):
+    """ (アーカイブの全行, そのキーの集合) """
+    rows = archive.records("results")
+    return rows, {_record_key(r) for r in rows}
+
+def _with_archive(snap):
+    if "results" not in snap.tables: return snap
+    stamp = archive.stamp()
+    if stamp is None: return snap
+    archived, keys = _archived_results(stamp)
+    if not archived: return snap
+    live = snap.tables["results"]
+    # 締めた後にシートで直した (同じキーの行がある) 結果は、シートの方を使う
+    fixed = {k for k in map(_record_key, live) if k in keys}
+    if fixed: archived = tuple(r for r in archived if _record_key(r) not in fixed)
+    tables = dict(snap.tables)
+    tables["results"] = archived + tuple(live)
+    return dataclasses.replace(snap, tables=MappingProxyType(tables), archived=MappingProxyType({"results": len(archived)}))
+
+# --- 書き込みキュー (write-behind) ---
+# 1行単位の保存 (save_user / save_entry / save_results_batch など) は write_queue に積んですぐに戻り、
+# 裏のスレッドがまとめてシートに反映する。積んだ分は反映前から load_snapshot() に重ねて見せるので、
+# 書いた本人にも他の人にもすぐに見える。行の位置に依存する書き込み (スタートリストの保存・
+# 全体の上書き・manage.py のコマンド) はその場で書く。
+@st.cache_resource(show_spinner=False)
+def _write_queue():
+    """ プロセスで1つのキュー。使わない設定なら None """
+    backend, _ = storage._config()
+    enabled, path = write_queue.config(backend)
+    if not enabled: return None
+    q = write_queue.WriteQueue(path, _flush_writes)
+    if q.pending(): q.start() # 前回反映しきれなかった分
+    return q
+
+def _write(writes):
+    """ 書き込みをキューに積む (キューを使わない設定ならその場で反映する) """
+    q = _write_queue()
+    if q is not None:
+        ids = q.put(writes)
+        try: st.session_state.setdefault("_write_ids", []).extend(ids)
+        except Exception: pass # streamlit の外
+        return
+    for i, w in enumerate(writes): w.id = i
+    errors = _flush_writes(writes)
+    invalidate()
+    if errors: raise ValueError(next(iter(errors.values())))
+
+def _writes_paused():
+    """ キューの分を反映し終えてから、抜けるまでこのプロセスの反映を止める (キューを使わない設定なら何もしない) """
+    q = _write_queue()
+    return q.paused() if q is not None else contextlib.nullcontext()
+
+def _locate(table, writes, snap, header):
+    """
+    writes の行を snap の行番号 (Snapshot.row_number) で引き、(書き換えるセル {(行番号, 列): 値}, 追加する行,
+    見つからないキーがあったか, エラー, 書き換える行 {行番号: (キーの列, キーの値)}) を返す
+    """
+    cells, new_rows, errors, targets = {}, {}, {}, {}
+    missing = False
+    for w in writes:
+        k = tuple(str(v) for v in storage.as_read(list(w.key.values())))
+        if k in new_rows:
+            # このまとめの中で先に追加した行
+            if w.mode != "insert": new_rows[k].update(w.values)
+            continue
+        row = snap.row_number(table, tuple(w.key.values()), tuple(w.key))
+        if row is None:
+            missing = True
+            if w.mode == "update":
+                errors[w.id] = f"{table}: 更新する行が見つかりません ({w.key})"
+                continue
+            new_rows[k] = dict(w.key, **w.values)
+        elif w.mode != "insert":
+            targets[row] = (tuple(w.key), k)
+            for c, v in w.values.items():
+                if c in header: cells[(row, c)] = v
+    return cells, new_rows, missing, errors, targets
+
+VERIFY_MAX_ROWS = 50 # これより多くの行を書き換えるときは、行を確かめずにテーブルを読み直す
+
+def _rows_match(store, table, targets):
+    """ シートの行番号 targets の行が、今もそのキーの行か (手元のスナップショットの後に行の削除・並べ替えが無いか) """
+    if not targets: return True
+    if len(targets) > VERIFY_MAX_ROWS: return False
     try:
-        key_dict = json.loads(st.secrets["gcp_service_account"]["json_content"])
-        scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
-        creds = Credentials.from_service_account_info(key_dict, scopes=scopes)
-        return gspread.authorize(creds)
+        got = store.get_rows(table, targets)
+    except quota.Throttled:
+        raise
     except Exception as e:
-        st.error(f"GCP Error: {e}")
-        return None
+        print(f"Verify Rows Error: {e}")
+        return False
+    return all(
+        row in got and tuple(str(got[row].get(c, "")) for c in cols) == k
+        for row, (cols, k) in targets.items()
+    )
+
+def _flush_writes(writes):
+    """
+    積まれた書き込みをシートに反映する。行の場所は手元のスナップショット (シートの内容) から引き、
+    テーブルごとに書き換えるセルの書き込み1回・新しい行の追記1回にまとめる。
+    書き換える行はキーを読んで今もその行か確かめ (行の削除・並べ替えに備える)、
+    違っていたときと、手元のスナップショットに無いキーがあったとき (他で追加された行かもしれない) だけ、そのテーブルを読み直す。
+    反映できなかった項目 (更新する行が無いなど) の {id: 理由} を返す。
+    """
+    store = get_storage()
+    tables = list(dict.fromkeys(w.table for w in writes))
+    cached = _snapshot_cache().latest()
+    errors = {}
+    for table in tables:
+        # ヘッダーを確かめ、足りない列は右端に足す (ヘッダーの無いシートには最上段に挿入する)。
+        # スキーマにもヘッダーにも無い列 (画面用のキーなど) は書かない
+        schema = storage.SCHEMAS.get(table)
+        if schema:
+            header = store.ensure_header(table)
+        else:
+            needed = list(dict.fromkeys(c for w in writes if w.table == table for c in list(w.key) + list(w.values)))
+            header = store.get_header(table) or store.ensure_header(table, needed)
+        table_writes = [w for w in writes if w.table == table]
+        # 行番号がずれる書き直し (overwrite) より後に取ったスナップショットなら、その行番号を使う
+        # (追記では前の行の番号は変わらない)
+        usable = cached is not None and table in cached.tables and cached.fetched_at > store.rewritten_at(table)
+        moved = False
+        if usable:
+            cells, new_rows, missing, table_errors, targets = _locate(table, table_writes, cached, header)
+            # シートの上で行が消された・並べ替えられたかもしれないので、書き換える行のキーを読んで確かめる
+            moved = not missing and not _rows_match(store, table, targets)
+            usable = not missing and not moved
+        if not usable:
+            # 行がずれていたなら、更新時刻がまだ変わっていなくても読み直す
+            fresh = store.get_snapshot([table], fresh=moved)
+            records = fresh.sheet_records(table)
+            cells, new_rows, missing, table_errors, targets = _locate(table, table_writes, fresh, header)
+            # 読み直した今の値と同じセルは書かない (手元のコピーの値とは比べない)
+            cells = {(row, c): v for (row, c), v in cells.items() if storage.as_read([v])[0] != records[row - 2].get(c, "")}
+        errors.update(table_errors)
+        store.update_cells(table, [(row, c, v) for (row, c), v in cells.items()])
+        store.append_rows(table, [[d.get(c, "") for c in header] for d in new_rows.values()])
+    _snapshot_cache().invalidate()
+    return errors
+
+_overlay_rows = {} # 書き込みの id -> (重ねる前の行, 重ねた行)
+
+def _overlay_row(w, base, make):
+    """
+    キューの書き込みを重ねた行。重ねる前の行が同じなら前回と同じものを返す
+    (行が同じものなら、results の集計は作り直さずに差分で追いつける)
+    """
+    hit = _overlay_rows.get(w.id)
+    if hit is not None and hit[0] is base: return hit[1]
+    row = storage.freeze(make())
+    _overlay_rows[w.id] = (base, row)
+    return row
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _pending_view(version, generation, _snap, _writes):
+    """ スナップショットに、キューの未反映分を重ねたもの """
+    tables = dict(_snap.tables)
+    rows_of, added = {}, {}
+    for w in _writes:
+        rows = rows_of.get(w.table)
+        if rows is None: rows = rows_of[w.table] = list(tables.get(w.table, ()))
+        key = dict(zip(w.key, storage.as_read(list(w.key.values()))))
+        values = dict(zip(w.values, storage.as_read(list(w.values.values()))))
+        # シートにある行はフラッシュと同じ索引 (Snapshot.row_number) で、ここで足した行は順に探す
+        row = _snap.row_number(w.table, tuple(w.key.values()), tuple(w.key))
+        if row is not None:
+            i = row - 2 + _snap.archived.get(w.table, 0)
+        else:
+            k = tuple(str(v) for v in key.values())
+            i = next((j for j in added.get(w.table, ()) if tuple(str(rows[j].get(c, "")) for c in w.key) == k), None)
+        if i is not None:
+            if w.mode != "insert":
+                old = rows[i]
+                rows[i] = _overlay_row(w, old, lambda: {**old, **values})
+        elif w.mode != "update":
+            base = dict.fromkeys(rows[0] if rows else storage.SCHEMAS.get(w.table, ()), "")
+            rows.append(_overlay_row(w, None, lambda: {**base, **key, **values}))
+            added.setdefault(w.table, []).append(len(rows) - 1)
+    tables.update(rows_of)
+    # 反映済みの書き込みの分は捨てる
+    for k in set(_overlay_rows) - {w.id for w in _writes}: _overlay_rows.pop(k, None)
+    return storage.Snapshot.build(tables, _snap.fetched_at, previous=_snap, archived=_snap.archived)
 
-def get_sheet():
-    client = get_gspread_client()
-    if not client: return None
+def _with_pending(snap):
+    q = _write_queue()
+    if q is None: return snap
     try:
-        return client.open_by_key(SPREADSHEET_KEY)
+        writes = q.visible(snap.fetched_at)
+        if not writes: return snap
+        return _pending_view(snap.version, (q.generation, writes[-1].id), snap, writes)
     except Exception as e:
-        st.error(f"スプレッドシートエラー: {e}")
-        return None
+        print(f"Write Queue Error: {e}")
+        return snap
+
+def write_status():
+    """
+    画面表示用: このセッションで保存した項目のうち (反映待ちの件数, 反映に失敗した項目のリスト)。
+    キューを使っていなければ (0, [])
+    """
+    q = _write_queue()
+    if q is None: return 0, []
+    try: ids = st.session_state.get("_write_ids", [])
+    except Exception: ids = []
+    items = q.status(ids)
+    # 反映済みのものは覚えておかなくてよい
+    try: st.session_state["_write_ids"] = [w.id for w in items if w.status != write_queue.DONE]
+    except Exception: pass
+    return sum(w.status == write_queue.PENDING for w in items), [w for w in items if w.status == write_queue.FAILED]
+
+def retry_failed_writes():
+    """ このセッションで反映に失敗した項目をもう一度試す """
+    q = _write_queue()
+    if q is None: return
+    _, failed = write_status()
+    q.retry([w.id for w in failed])
+
+@st.cache_resource(show_spinner=False)
+def _snapshot_cache():
+    return cache.SWRCache(_fetch_snapshot, SNAPSHOT_SOFT_TTL, SNAPSHOT_HARD_TTL)
+
+def _written_at():
+    """ このセッションで最後に書き込んだ時刻 """
+    try: return st.session_state.get("_written_at", 0.0)
+    except Exception: return 0.0 # streamlit の外 (manage.py など)
+
+def _sheet_snapshot():
+    """ シートの内容そのもの (書き込みキューの未反映分を含まない) """
+    try:
+        # 自分が書き込んだ後は、その変更を含むスナップショットが取れるまで待つ
+        return _snapshot_cache().get(_written_at())
+    except quota.Throttled as e:
+        # API が混んでいる: 古くても手元のコピーがあればそれを見せる (空のページにしない)
+        print(f"Snapshot Throttled: {e}")
+        snap = _snapshot_cache().latest()
+        if snap is not None: return snap
+        _show_throttled()
+        return storage.Snapshot()
+    except Exception as e:
+        _handle_error(e)
+        print(f"Snapshot Error: {e}")
+        return storage.Snapshot()
+
+def load_snapshot():
+    """ 画面用のスナップショット (書き込みキューにあってまだシートに入っていない分も反映済み) """
+    return _with_pending(_sheet_snapshot())
+
+def _show_throttled():
+    """ 見せられるデータが無いときは「データがありません」ではなく混雑中と表示して止める """
+    if not st.runtime.exists(): raise quota.Throttled("Sheets API の呼び出しが混み合っています")
+    st.warning("⏳ アクセスが集中しているため、データを読み込めませんでした。少し待ってから再読み込みしてください。")
+    st.stop()
+
+def invalidate():
+    """ 書き込み後に呼ぶ。裏で取り直し、書き込んだ本人の次の読み込みは新しい内容を待つ """
+    _snapshot_cache().invalidate()
+    try: st.session_state["_written_at"] = time.time()
+    except Exception: pass
+
+def data_status():
+    """
+    画面表示用: (表示中データの経過秒数 or None, 直近の取り直しエラー or None)。
+    API が混んでいて取り直せなかったときのエラーは quota.Throttled
+    """
+    c = _snapshot_cache()
+    return c.age(), c.last_error
+
+# --- 行の場所 ---
+# 1行だけ書き換えるときは、スナップショットの 主キー -> 行番号 の索引で場所を決める
+# (シートを検索・全件取得しない)。書き込んだ本人の load_snapshot() は書き込み後のものなので、
+# 直前に追加した行も引ける。スナップショットより後に行がずれる書き込み (overwrite) をしていたり、
+# 別のバックエンド (manage.py の --backend) に書くときはシートを探す。
+def _row_number(store, table, *key):
+    """ storage.PRIMARY_KEYS の値 key の行番号 (無ければ None) """
+    # アプリのバックエンドのときだけ、そのスナップショットから引く (管理コマンドが別のバックエンドを渡したときは読まない)
+    if store is get_storage():
+        snap = _sheet_snapshot()
+        if table in snap.tables and snap.fetched_at > store.rewritten_at(table):
+            return snap.row_number(table, key)
+    cols = storage.PRIMARY_KEYS[table]
+    if len(cols) == 1: return store.find_row(table, cols[0], key[0])
+    want = [str(v) for v in storage.as_read(key)]
+    for i, r in enumerate(store.get_records(table)):
+        if [str(r.get(c, "")) for c in cols] == want: return i + 2
+    return None
+
+# --- 大会IDごとの索引 ---
+# entries / results / start_list はスナップショットごとに1回だけ comp_id で振り分けておき、
+# load_*(comp_id) はその索引から該当行を取り出すだけにする (大会を切り替えても再取得・再JOINしない)。
+# 索引はプロセス内で共有 (cache_resource) し、呼び出し側にもコピーせずにそのまま渡す
+# (行は storage.FrozenRecord、行の並びはタプル。書き換えたいときは呼び出し側でコピーする)。
+
+# results には大会名・日付・選手名を付けるので、大会・部員が変わったときも作り直す
+RESULTS_DEPS = ("results", "competitions", "members")
+
+def _deps(table):
+    """ table から作る索引が読むテーブル """
+    return RESULTS_DEPS if table == "results" else (table,)
+
+@st.cache_resource(max_entries=12, show_spinner=False)
+def _comp_index(generation, table, _snap):
+    """ (全行, comp_id -> 行のタプル) を返す """
+    if table == "results": rows = _join_results(_snap)
+    else: rows = tuple(storage.freeze(r) for r in _snap.tables.get(table, ()))
+    by_comp = {}
+    for r in rows:
+        by_comp.setdefault(str(r.get("comp_id", "")), []).append(r)
+    return rows, {cid: tuple(rs) for cid, rs in by_comp.items()}
+
+def _select(table, comp_id):
+    """ comp_id が空なら全行、指定があればその大会の行だけを返す """
+    snap = load_snapshot()
+    rows, by_comp = _comp_index(snap.generation(*_deps(table)), table, snap)
+    if comp_id: return by_comp.get(str(comp_id), ())
+    return rows
 
 # --- Users ---
-@st.cache_data(ttl=5)
 def load_users():
-    wb = get_sheet()
-    if not wb: return {}
+    """ user_id -> 部員 (読み取り専用。書き換えるときは dict(...) でコピーする) """
+    snap = load_snapshot()
+    return _users_view(snap.generation("members"), snap)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _users_view(generation, _snap):
     try:
-        try: sheet = wb.worksheet("members")
-        except: return {}
-        records = sheet.get_all_records()
+        records = _snap.tables.get("members", ())
         users = {}
         for r in records:
             uid = str(r.get("user_id"))
@@ -55,92 +392,39 @@ def load_users():
             u_data["events"] = events
             u_data["pbs"] = pbs
             u_data["id"] = uid # idキーも確保
-            users[uid] = u_data
-        return users
-    except: return {}
+            users[uid] = storage.freeze(u_data)
+        return MappingProxyType(users)
+    except Exception as e:
+        print(e)
+        return MappingProxyType({})
 
 def save_user(uid, user_data):
     """
     列の場所を自動で探して保存する「絶対ズレない」バージョン
     """
-    wb = get_sheet()
-    if not wb: return False
     try:
-        try: sheet = wb.worksheet("members")
-        except: return False
-        
-        # 1. 1行目のヘッダー（列名）をすべて読み込む
-        headers = sheet.row_values(1)
-        
-        # 2. 必要な列があるかチェック（なければ作る）
-        required_cols = ["user_id", "image", "bio", "name", "role", "role_title", "status", "block", "affiliation", "univ_cat", "grad_year", "events", "pbs", "name_kana", "password"]
-        
-        # ヘッダーに足りない列があれば追加する機能
-        missing_cols = [c for c in required_cols if c not in headers]
-        if missing_cols:
-            # 足りない列を右端に追加
-            sheet.add_cols(len(missing_cols))
-            # ヘッダーを更新
-            first_row_len = len(headers)
-            for i, col_name in enumerate(missing_cols):
-                sheet.update_cell(1, first_row_len + i + 1, col_name)
-            # ヘッダーを再取得
-            headers = sheet.row_values(1)
-
-        # 3. どのデータが何列目か（インデックス）を特定
-        # 例: {"user_id": 0, "name": 1, "image": 13 ...}
-        col_map = {name: i for i, name in enumerate(headers)}
-        
-        # 4. 保存する行のデータを作る
-        # まずは空文字で埋めたリストを作る
-        row_values = [""] * len(headers)
-        
-        # user_dataの中身を、正しい場所に配置する
+        # 保存する行のデータを作る (列は名前で指定するので、シートの列順は問わない)
+        # 必要な列 (storage.SCHEMAS) は空文字で埋め、その行をまるごと書き換える
+        row = dict.fromkeys(storage.SCHEMAS["members"], "")
         for key, val in user_data.items():
-            if key in col_map:
-                idx = col_map[key]
-                # リストや辞書はJSON文字列に
-                if isinstance(val, (list, dict)):
-                    val = json.dumps(val, ensure_ascii=False)
-                row_values[idx] = val
+            # リストや辞書はJSON文字列に (load_users の読み取り専用の行ではタプル)
+            if isinstance(val, (list, tuple, dict)):
+                val = json.dumps(val, ensure_ascii=False)
+            row[key] = val
         
-        # 5. 更新対象の行を探す (user_id が一致する行)
-        cell = None
-        try:
-            # user_id列(A列とは限らないので探す)
-            uid_col_idx = col_map.get("user_id") + 1
-            cell = sheet.find(str(uid), in_column=uid_col_idx)
-        except:
-            pass
-
-        if cell:
-            # 更新: その行をまるごと書き換え
-            # gspreadの update メソッドで行更新
-            # A1記法を作るのが面倒なので、行番号を指定して更新
-            row_num = cell.row
-            
-            # 安全のため、セル範囲を計算して更新
-            # 1行分の範囲 (例: A2:Z2)
-            end_col_char = chr(ord('A') + len(row_values) - 1)
-            # 列数が26を超えると 'AA' とかになるので、厳密にはこう書く↓
-            sheet.update(f"A{row_num}", [row_values])
-        else:
-            # 新規: 末尾に追加
-            sheet.append_row(row_values)
-            
-        load_users.clear()
+        # user_id が一致する行を書き換え、無ければ末尾に追加 (書き込みキュー経由)
+        _write([Write("members", {"user_id": uid}, row)])
         return True
 
     except Exception as e:
+        _handle_error(e)
         print(f"Save User Error: {e}")
         return False
 
 def save_users_batch(user_list):
-    wb = get_sheet()
-    if not wb: return False, "Connection Failed"
     try:
-        sheet = wb.get_worksheet(0)
-        records = sheet.get_all_records()
+        store = get_storage()
+        records = store.get_records("members")
         existing_ids = {str(r["user_id"]): i for i, r in enumerate(records)}
         new_rows = []
         for u in user_list:
@@ -153,21 +437,19 @@ def save_users_batch(user_list):
             ]
             new_rows.append(row_data)
         if new_rows:
-            sheet.append_rows(new_rows)
-            load_users.clear()
+            store.append_rows("members", new_rows)
+            invalidate()
             return True, f"{len(new_rows)} users added."
         else: return True, "No new users."
-    except Exception as e: return False, str(e)
+    except Exception as e:
+        _handle_error(e)
+        return False, str(e)
 
 def save_all_users_overwrite(users_list):
     """
     ユーザーリスト(辞書のリスト)を受け取り、シート全体を上書き保存する
     """
-    wb = get_sheet()
-    if not wb: return False
     try:
-        sheet = wb.worksheet("members")
-        
         # ★修正: image と bio を追加して、全15列に合わせました
         header = [
             "user_id", "name", "password", "role", "role_title", "status", 
@@ -176,38 +458,38 @@ def save_all_users_overwrite(users_list):
         ]
         
         # 2. データをリスト形式(行)に変換
-        rows = [header] # 1行目はヘッダー
+        rows = []
         
         for u in users_list:
             row = []
             for col in header:
                 val = u.get(col, "")
                 # リストや辞書は文字列(JSON)に変換して保存
-                if isinstance(val, (list, dict)):
+                if isinstance(val, (list, tuple, dict)):
                     val = json.dumps(val, ensure_ascii=False)
                 row.append(val)
             rows.append(row)
             
-        # 3. シートをクリアして書き込み
-        sheet.clear()
-        sheet.update(rows) 
+        # 3. シートをクリアして書き込み (1行目はヘッダー)
+        get_storage().overwrite("members", header, rows)
         
-        load_users.clear() # キャッシュクリア
+        invalidate() # キャッシュクリア
         return True
     except Exception as e:
+        _handle_error(e)
         st.error(f"Save All Users Error: {e}")
         return False
     
 # --- Competitions ---
-@st.cache_data(ttl=5)
 def load_competitions():
-    wb = get_sheet()
-    if not wb: return []
+    """ 大会の一覧 (読み取り専用のタプル。並べ替えは sorted(...) で) """
+    snap = load_snapshot()
+    return _competitions_view(snap.generation("competitions"), snap)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _competitions_view(generation, _snap):
     try:
-        try: sheet = wb.worksheet("competitions")
-        except: return []
-        
-        records = sheet.get_all_records()
+        records = _snap.records("competitions")
         
         # ★互換性対応:
         # シート上は "comp_id", "comp_name" ですが、
@@ -221,22 +503,19 @@ def load_competitions():
             if "comp_name" in r:
                 r["name"] = r["comp_name"]
                 
-        return records
-    except: return []
+        return storage.freeze(records)
+    except Exception as e:
+        print(e)
+        return ()
 
 def save_competition(d):
     """
     大会を保存する
     列定義: comp_id, comp_name, date, location, deadline, status, events, valid_start, valid_end
     """
-    wb = get_sheet()
-    if not wb: return False
     try:
-        try: s = wb.worksheet("competitions")
-        except: 
-            s = wb.add_worksheet("competitions", 100, 10)
-            # ★ヘッダーを更新
-            s.append_row(["comp_id", "comp_name", "date", "location", "deadline", "status", "events", "valid_start", "valid_end"])
+        store = get_storage()
+        header = store.get_header("competitions")
         
         # ヘッダー確認 (もし古い "id", "name" のままなら、列名だけ修正するか、作り直すのが無難ですが、ここでは追加のみ行います)
         
@@ -255,56 +534,44 @@ def save_competition(d):
             str(d.get("valid_start") or ""), 
             str(d.get("valid_end") or "")
         ]
-        s.append_row(new_row)
-        load_competitions.clear()
+        if header and "comp_id" not in header:
+            # 古い列名のシートには列の位置で直接追加する
+            store.append_rows("competitions", [new_row])
+            invalidate()
+        else:
+            # (シートが無ければ反映時に ★ヘッダーごと作成)
+            row = dict(zip(storage.SCHEMAS["competitions"], new_row))
+            _write([Write("competitions", {"comp_id": row["comp_id"]}, row, "insert")])
         return True
     except Exception as e: 
+        _handle_error(e)
         st.error(f"Save Error: {e}")
         return False
 
 def update_competition_status(comp_id, new_status):
-    wb = get_sheet()
-    if not wb: return False
     try:
-        sheet = wb.worksheet("competitions")
-        cell = sheet.find(str(comp_id))
-        if cell:
-            # statusはF列(6)と仮定するが、検索して特定推奨
-            header = sheet.row_values(1)
-            col_idx = header.index("status") + 1
-            sheet.update_cell(cell.row, col_idx, new_status)
-            load_competitions.clear()
+        store = get_storage()
+        header = store.get_header("competitions")
+        if not header or "comp_id" in header:
+            # status 列だけを書き換える (書き込みキュー経由)
+            _write([Write("competitions", {"comp_id": comp_id}, {"status": new_status}, "update")])
+            return True
+        # 古いシートは "id" 列の場合がある
+        row_num = store.find_row("competitions", "id", comp_id)
+        if row_num:
+            # status列はヘッダーから特定
+            store.update_cell("competitions", row_num, "status", new_status)
+            invalidate()
             return True
-    except: pass
+    except Exception as e: _handle_error(e)
     return False
 
 # --- Entries ---
-@st.cache_data(ttl=5)
 def load_entries(cid=None):
-    wb = get_sheet()
-    if not wb: return []
-    try:
-        sheet = wb.worksheet("entries")
-        recs = sheet.get_all_records()
-        if cid: return [r for r in recs if str(r.get("comp_id")) == str(cid)]
-        return recs
-    except: return []
+    return _select("entries", cid)
 
 def save_entry(d):
-    wb = get_sheet()
-    if not wb: return False
     try:
-        try: s = wb.worksheet("entries")
-        except: s = wb.add_worksheet("entries", 1000, 10)
-        
-        # 既存チェック
-        records = s.get_all_records()
-        target_row = None
-        for i, r in enumerate(records):
-            if str(r.get("comp_id")) == str(d["comp_id"]) and str(r.get("user_id")) == str(d["user_id"]):
-                target_row = i + 2
-                break
-        
         row_data = [
             d.get("entry_id", str(uuid.uuid4())[:8]),
             str(d["comp_id"]), str(d["user_id"]), d["user_name"],
@@ -313,46 +580,48 @@ def save_entry(d):
             d.get("comment", ""), str(datetime.now())
         ]
         
-        if target_row:
-            # 列数に合わせて更新（A:H）
-            s.update(f"A{target_row}:H{target_row}", [row_data])
-        else:
-            if not records: s.append_row(["entry_id","comp_id","user_id","user_name","events","times","comment","timestamp"])
-            s.append_row(row_data)
-            
-        load_entries.clear()
+        # 同じ大会・選手の行があれば書き換え、無ければ追加 (書き込みキュー経由)
+        row = dict(zip(storage.SCHEMAS["entries"], row_data))
+        _write([Write("entries", {"comp_id": row["comp_id"], "user_id": row["user_id"]}, row)])
         return True
-    except: return False
+    except Exception as e:
+        _handle_error(e)
+        return False
 
 # --- Results (Normalized) ---
 # ここが重要：保存はIDのみ、読み込み時にJOIN
 
-@st.cache_data(ttl=3)
 def load_results(comp_id=None):
-    wb = get_sheet()
-    if not wb: return []
+    return _select("results", comp_id)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _user_index(generation, _snap):
+    rows, _ = _comp_index(generation, "results", _snap)
+    return {uid: storage.freeze(rs) for uid, rs in results_index.by_user(rows).items()}
+
+def load_user_results(user_id):
+    """ 1人分のリザルト (日付順、数値化した記録 record_val 付き)。全リザルトは舐めない """
+    snap = load_snapshot()
+    return _user_index(snap.generation(*RESULTS_DEPS), snap).get(str(user_id), ())
+
+def _join_results(_snap):
+    """ 全リザルトに大会名・日付・選手名を付ける (大会での絞り込みは索引側で行う) """
     try:
-        try: sheet = wb.worksheet("results")
-        except: return []
-        
-        raw_results = sheet.get_all_records()
-        if not raw_results: return []
+        raw_results = _snap.tables.get("results", ())
+        if not raw_results: return ()
 
-        # 1. 大会マスタと部員マスタを取得
-        comps = load_competitions()
+        # 1. 大会マスタと部員マスタを取得 (同じスナップショットから)
+        comps = _competitions_view(_snap.generation("competitions"), _snap)
         comp_map = {str(c["id"]): c for c in comps}
         
-        users = load_users() # ID -> UserData
+        users = _users_view(_snap.generation("members"), _snap) # ID -> UserData
         
         cleaned_results = []
+        # 数値化した記録 (保存時の mark_value。無い古い行はここで一括解析)
+        marks = results_index.mark_values(raw_results)
         
-        target_cid = str(comp_id) if comp_id else None
-        
-        for r in raw_results:
-            # フィルタリング
+        for r, mark in zip(raw_results, marks):
             row_cid = str(r.get("comp_id", ""))
-            if target_cid and row_cid != target_cid: continue
-            
             row_uid = str(r.get("user_id", ""))
             
             # --- JOIN処理 ---
@@ -366,7 +635,7 @@ def load_results(comp_id=None):
             user_name = u_info.get("name", "未登録選手")
             
             # データ構築 (UI表示用に名称を含める)
-            cleaned_results.append({
+            cleaned_results.append(storage.FrozenRecord({
                 "result_id": str(r.get("result_id", "")),
                 "comp_id": row_cid,
                 "comp_name": comp_name, # 表示用
@@ -383,47 +652,50 @@ def load_results(comp_id=None):
                 "result": str(r.get("result", "")),
                 "wind": str(r.get("wind", "")),
                 "rank": str(r.get("rank", "")),
-                "comment": str(r.get("comment", ""))
-            })
+                "comment": str(r.get("comment", "")),
+                "mark_value": mark,
+                "mark_status": str(r.get("mark_status", "")),
+                "record_flag": str(r.get("record_flag", ""))
+            }))
             
-        return cleaned_results
+        return tuple(cleaned_results)
     except Exception as e:
         print(e)
-        return []
+        return ()
+
+# ★決定版のヘッダー定義 (storage.SCHEMAS)
+RESULTS_HEADER = storage.SCHEMAS["results"]
+# 同じ (大会, 選手, 種目, ラウンド, 組) の結果は1行にまとめる
+RESULTS_KEY = list(storage.PRIMARY_KEYS["results"])
+
+def _result_key(r):
+    """ 同じ結果かどうかを比べるキー (シートから読み戻した値と同じ形にして比べる) """
+    return tuple(str(v) for v in storage.as_read([r.get(k, "") for k in RESULTS_KEY]))
 
 def save_results_batch(results_list):
     """
     結果データを保存する。ヘッダーがない場合は強制的に挿入する。
+    既にある (comp_id, user_id, event, round, heat) の行は書き換え (内容が同じなら何もしない)、
+    新しい結果だけを末尾に追加する。
     """
-    wb = get_sheet()
-    if not wb: return False
     try:
-        # シート取得（なければ作成）
-        try: sheet = wb.worksheet("results")
-        except: sheet = wb.add_worksheet("results", 5000, 15)
-        
-        # ★決定版のヘッダー定義
-        header = [
-            "result_id", "comp_id", "user_id", "event", 
-            "division", "round", "heat", "lane", 
-            "result", "wind", "rank", "comment"
-        ]
-        
-        # ★修正ポイント: get_all_values() ではなく、具体的に1行目を確認する
-        # 1行目のデータを取得
-        first_row = sheet.row_values(1)
+        header = RESULTS_HEADER
         
-        # 「1行目が空っぽ」または「1行目の先頭が result_id ではない」場合
-        # ヘッダー行を【挿入】します（appendではなくinsertを使うことで最上段を確保）
-        if not first_row or first_row[0] != "result_id":
-            sheet.insert_row(header, index=1)
+        # 既存の行: キー -> 行 (書き込みキューの未反映分も含めた今の内容)
+        existing = {}
+        results = load_snapshot().tables.get("results", ())
+        for rec in results:
+            if str(rec.get("comp_id", "")): existing[_record_key(rec)] = rec
             
-        # データ作成
-        rows_to_add = []
+        # データ作成 (同じキーがバッチ内に複数あれば後のものを使う)
+        pending = {}
+        pbs = _caught_up(_personal_bests())
         for r in results_list:
             if not r.get("comp_id") or not r.get("result"):
                 continue
-                
+            
+            # 記録はここで1回だけ数値化しておく
+            mark_value, mark_status = utils.normalize_record(r.get("result"), str(r.get("event", "")))
             row = [
                 str(r.get("result_id", uuid.uuid4())), 
                 str(r.get("comp_id")),
@@ -436,117 +708,469 @@ def save_results_batch(results_list):
                 str(r.get("result", "")),
                 str(r.get("wind", "")),
                 str(r.get("rank", "")),
-                str(r.get("comment", ""))
+                str(r.get("comment", "")),
+                str(mark_value),
+                mark_status,
+                ""
             ]
-            rows_to_add.append(row)
+            pending[_result_key(dict(zip(header, row)))] = row
+        
+        # 既存の行は書き換え (変更が無ければ飛ばす)、無いものだけ追加
+        written, n_updates, replaced = [], 0, set()
+        for key, row in pending.items():
+            rec = existing.get(key)
+            if rec:
+                row[0] = str(rec.get("result_id") or row[0]) # ID は元のまま
+                if storage.as_read(row[1:12]) == [rec.get(c, "") for c in header[1:12]]: continue
+                written.insert(n_updates, row)
+                n_updates += 1
+                replaced.add(id(rec))
+            else:
+                written.append(row)
             
-        if rows_to_add:
-            sheet.append_rows(rows_to_add)
-            load_results.clear()
-            return True
+        if written:
+            written_recs = [dict(zip(header, row)) for row in written]
+            for rec in written_recs:
+                if rec["mark_value"]: rec["mark_value"] = float(rec["mark_value"])
+            # 自己ベスト・シーズンベストの更新は保存時に判定して記録しておく。
+            # 書き換える行のある選手・種目は、その行の元の内容を除いた行と比べる (訂正した記録を自分と比べない)
+            touched = {(rec["user_id"], rec["event"]) for rec in written_recs[:n_updates]}
+            history = {k: [] for k in touched}
+            if touched:
+                for rec in results:
+                    k = (str(rec.get("user_id", "")), str(rec.get("event", "")))
+                    if k in history and id(rec) not in replaced: history[k].append(rec)
+            for rec, values, flag in zip(written_recs, written, pbs.flags(written_recs, history)):
+                rec["record_flag"] = values[-1] = flag
+            # (大会, 選手, 種目, ラウンド, 組) で行を探して書き換え・追加する (書き込みキュー経由)
+            _write([
+                Write("results", {k: row[header.index(k)] for k in RESULTS_KEY}, dict(zip(header, row)))
+                for row in written
+            ])
+            # ランキング・自己ベストには追加した行だけを差分で反映する
+            # (書き換えた行は、次のスナップショットで作り直すときに反映される)
+            added = written_recs[n_updates:]
+            _leaderboards().add(added)
+            pbs.add(added)
         
         return True
         
     except Exception as e:
+        _handle_error(e)
         st.error(f"Save Error: {e}")
         return False
 
+def backfill_result_marks(store=None, recompute=False):
+    """
+    mark_value / mark_status が空の既存リザルト行を埋める (recompute=True なら全行を計算し直す)。
+    更新した行数を返す。
+    """
+    store = store or get_storage()
+    store.ensure_header("results", RESULTS_HEADER) # mark_value / mark_status の列が無ければ足す
+    records = store.get_records("results")
+    values, statuses, changed = [], [], 0
+    for r in records:
+        value, status = r.get("mark_value", ""), r.get("mark_status", "")
+        if recompute or (value == "" and status == ""):
+            new_value, new_status = utils.normalize_record(r.get("result"), str(r.get("event", "")))
+            if (str(new_value), new_status) != (str(value), str(status)): changed += 1
+            value, status = new_value, new_status
+        values.append(value)
+        statuses.append(status)
+    if changed:
+        store.update_columns("results", {"mark_value": values, "mark_status": statuses})
+        invalidate()
+    return changed
+
+def _overwrite_results(store, values, header, rows):
+    """
+    results を読んだとき (values) から変わっていなければ、ヘッダー + rows で丸ごと書き直す。
+    その間に行が足された・書き換えられたなら、消してしまわないように ValueError で止める
+    """
+    if store.get_values("results") != values:
+        raise ValueError("読み込んだ後に results が書き換えられました。もう一度実行してください")
+    store.overwrite("results", header, rows)
+
+def compact_results(store=None, dry_run=False):
+    """
+    同じ (comp_id, user_id, event, round, heat) の重複行を1行にまとめる (最後に保存された行を残す)。
+    空行も取り除く。(整理前の行数, 整理後の行数) を返す。
+    書き込みキューの分を反映してから読み、書き直す直前に読み直して変わっていれば止める。
+    """
+    store = store or get_storage()
+    with _writes_paused():
+        values = store.get_values("results")
+        if not values: return 0, 0
+        header = values[0]
+        records = storage.to_records(values)
+        last = {}
+        for i, rec in enumerate(records):
+            if not str(rec.get("comp_id", "")): continue
+            last[_result_key(rec)] = i
+        keep = sorted(last.values())
+        if len(keep) < len(records) and not dry_run:
+            rows = [values[i + 1] + [""] * (len(header) - len(values[i + 1])) for i in keep]
+            _overwrite_results(store, values, header, rows)
+            invalidate()
+    return len(records), len(keep)
+
+def freeze_results_season(season, store=None, dry_run=False):
+    """
+    締めた年度 (4月始まり) のリザルトをシートからアーカイブに移す (manage.py freeze-season)。
+    アーカイブのファイルとマニフェストを書いて読み戻せたのを確かめてから、シートの行を消す。
+    書き込みキューの分を反映してから読み、書き直す直前に読み直して変わっていれば止める。移した行数を返す。
+    """
+    current = results_index.season_of(datetime.now().strftime("%Y-%m-%d"))
+    if season >= current: raise ValueError(f"{season}年度はまだ終わっていません (今は{current}年度)")
+    store = store or get_storage()
+    with _writes_paused():
+        values = store.get_values("results")
+        if not values: return 0
+        header = list(values[0])
+        while header and header[-1] == "": header.pop()
+        rows = [(list(r) + [""] * len(header))[:len(header)] for r in values[1:]]
+        
+        # 大会の開催日で年度を決める (大会が見つからない行はシートに残す)
+        comp_season = {str(c.get("comp_id", "")): results_index.season_of(c.get("date")) for c in store.get_records("competitions")}
+        frozen, kept, expected = [], [], {}
+        for row, rec in zip(rows, storage.to_records([header] + rows)):
+            if comp_season.get(str(rec.get("comp_id", ""))) == season:
+                frozen.append(row)
+                expected[_record_key(rec)] = rec # 同じキーは後の行が残る
+            else:
+                kept.append(row)
+        if frozen and not dry_run:
+            archive.freeze("results", season, header, frozen, key=_record_key)
+            archived = {_record_key(r): r for r in storage.to_records(archive.read_season("results", season))}
+            for k, rec in expected.items():
+                got = archived.get(k)
+                if got is None or any(got.get(c) != v for c, v in rec.items()):
+                    raise ValueError(f"アーカイブに {season}年度の行が書き込めていません ({k})。シートの行は消していません")
+            _overwrite_results(store, values, header, kept)
+            invalidate()
+    return len(frozen)
+
+# --- 種目別ランキング ---
+@st.cache_resource(show_spinner=False)
+def _leaderboards():
+    """ プロセス内で1つ。書き込みと新しいスナップショットの差分だけを反映する """
+    return results_index.Leaderboards()
+
+def _caught_up(derived):
+    """ ランキングなどの集計を、今のスナップショットに追いつかせて返す """
+    snap = load_snapshot()
+    comp_dates = {str(c["id"]): str(c.get("date", "")) for c in _competitions_view(snap.generation("competitions"), snap) if "id" in c}
+    derived.catch_up(snap.generation("results", "competitions"), snap.tables.get("results", ()), comp_dates)
+    return derived
+
+def _current_leaderboards():
+    return _caught_up(_leaderboards())
+
+def load_ranking_options():
+    """ ランキングで選べる (種目のリスト, 年度のリスト(新しい順)) """
+    boards = _current_leaderboards()
+    return sorted(boards.events), sorted(boards.seasons, reverse=True)
+
+def load_ranking(event, season=None, per_athlete=False, n=5):
+    """
+    種目別ランキングの上位 n 件 (良い順)。season は年度 (None で通算)、
+    per_athlete=True なら1人1記録 (各選手のベストのみ)。
+    """
+    try:
+        rows = _current_leaderboards().top(event, season, per_athlete, n)
+        snap = load_snapshot()
+        users = _users_view(snap.generation("members"), snap)
+        comp_map = {str(c["id"]): c for c in _competitions_view(snap.generation("competitions"), snap) if "id" in c}
+        ranking = []
+        for r in rows:
+            c_info = comp_map.get(str(r.get("comp_id", "")), {})
+            ranking.append({
+                "user_id": str(r.get("user_id", "")),
+                "user_name": users.get(str(r.get("user_id", "")), {}).get("name", "未登録選手"),
+                "result": str(r.get("result", "")),
+                "wind": str(r.get("wind", "")),
+                "comp_id": str(r.get("comp_id", "")),
+                "comp_name": c_info.get("name", "未登録大会"),
+                "date": str(c_info.get("date", "2000-01-01")),
+            })
+        return ranking
+    except Exception as e:
+        print(e)
+        return []
+
+# --- 自己ベスト (PB) ・シーズンベスト (SB) ---
+@st.cache_resource(show_spinner=False)
+def _personal_bests():
+    """ プロセス内で1つ。save_results_batch と新しいスナップショットの差分だけを反映する """
+    return results_index.PersonalBests()
+
+def _comp_map():
+    snap = load_snapshot()
+    return {str(c["id"]): c for c in _competitions_view(snap.generation("competitions"), snap) if "id" in c}
+
+def _best_info(row, comp_map):
+    if not row: return None
+    c_info = comp_map.get(str(row.get("comp_id", "")), {})
+    return {
+        "result": str(row.get("result", "")),
+        "wind": str(row.get("wind", "")),
+        "mark_value": row.get("mark_value"),
+        "comp_id": str(row.get("comp_id", "")),
+        "comp_name": c_info.get("name", "未登録大会"),
+        "date": str(c_info.get("date", "2000-01-01")),
+    }
+
+def load_personal_bests(user_id):
+    """ 部内での自己ベスト {種目: {"result", "wind", "comp_name", "date", ...}} """
+    try:
+        rows = _caught_up(_personal_bests()).user_bests(user_id)
+        comp_map = _comp_map()
+        return {ev: _best_info(row, comp_map) for ev, row in rows.items()}
+    except Exception as e:
+        print(e)
+        return {}
+
+def get_season_best(user_id, event, season):
+    """ 年度 (4月始まり) のシーズンベスト。無ければ None """
+    try: return _best_info(_caught_up(_personal_bests()).season_best(user_id, event, season), _comp_map())
+    except Exception as e:
+        print(e)
+        return None
+
 # --- Start List (Start List も正規化思想で扱うが、便宜上名前も保持する場合がある。今回はIDベースで検索) ---
-@st.cache_data(ttl=10)
+# スタートリストは大会ごとのシート (start_list_<comp_id>) に分けて持ち、どの大会がどのシートかは
+# 目録 start_list_catalog (スナップショットに含まれる小さな表) で引く。
+# 1大会の読み書きはその大会のシートだけで済み、保存に失敗しても他の大会は消えない。
+# 全体保存は大会ごとに2枚のシート (start_list_<comp_id> と start_list_<comp_id>_b) を交互に使い、
+# 今読まれていない方に書き終えてから目録を付け替える (途中で失敗しても今のシートはそのまま)。
+# 付け替えた後は前のシートを空にする (古い内容がシート上で編集されないように)。
+# 目録に無い大会 (分ける前のデータ) は共有シート start_list から読む (manage.py split-start-list で移せる)。
+SL_CATALOG = storage.catalog_name("start_list")
+SL_CATALOG_HEADER = storage.SCHEMAS[SL_CATALOG]
+SL_PREFERRED_ORDER = ["comp_id", "競技始", "種目", "組", "レーン", "ナンバー", "氏名", "現PB", "目標記録", "所属", "招集始", "招集終", "備考"]
+
+def _sl_catalog_entry(comp_id):
+    """ 目録の行 (無ければ None) """
+    snap = load_snapshot()
+    return next((r for r in snap.tables.get(SL_CATALOG, ()) if str(r.get("comp_id")) == str(comp_id) and r.get("sheet")), None)
+
+@st.cache_resource(max_entries=32, ttl=SNAPSHOT_HARD_TTL, show_spinner=False)
+def _partition_records(sheet, version):
+    """ 大会1つ分のシートの行 (目録の version が変わる = 保存されるまで取り直さない) """
+    return storage.freeze(get_storage().get_records(sheet))
+
+def _start_list_partition(comp_id):
+    """ (目録の行, [(シート上の行番号, 行), ...]) 。目録に無い大会は (None, []) """
+    entry = _sl_catalog_entry(comp_id)
+    if not entry: return None, []
+    records = _partition_records(str(entry["sheet"]), str(entry.get("version", "")))
+    # 削除して空欄になった行は除く
+    return entry, [(i + 2, r) for i, r in enumerate(records) if str(r.get("comp_id", "")) == str(comp_id)]
+
+def _sl_header(keys):
+    """ 決まった列を先頭に並べたヘッダー """
+    keys = list(dict.fromkeys(["comp_id"] + list(keys)))
+    return [h for h in SL_PREFERRED_ORDER if h in keys] + [h for h in keys if h not in SL_PREFERRED_ORDER]
+
+def _touch_sl_catalog(store, comp_id, sheet):
+    """ 目録の行を作る・更新する (version を変えて、読み込み側のキャッシュを無効にする) """
+    header = store.ensure_header(SL_CATALOG, SL_CATALOG_HEADER)
+    vals = {"comp_id": str(comp_id), "sheet": sheet, "version": str(time.time_ns() // 1000), "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+    row = [vals.get(c, "") for c in header]
+    row_num = _row_number(store, SL_CATALOG, str(comp_id))
+    if row_num: store.update_row(SL_CATALOG, row_num, row)
+    else: store.append_rows(SL_CATALOG, [row])
+
 def load_start_list(comp_id):
     """ 指定された大会のスタートリスト（番組編成）を読み込む """
-    wb = get_sheet()
-    if not wb: return []
     try:
-        try: sheet = wb.worksheet("start_list")
-        except: return []
-        
-        records = sheet.get_all_records()
-        # comp_id が一致するものだけ抽出 (文字列にして比較)
-        target_str = str(comp_id)
-        return [r for r in records if str(r.get("comp_id")) == target_str]
-    except:
-        return []
+        entry, rows = _start_list_partition(comp_id)
+        if entry: return tuple(r for _, r in rows)
+    except quota.Throttled:
+        _show_throttled() # 空のスタートリストに見せない
+    except Exception as e:
+        _handle_error(e)
+        print(f"Load Start List Error: {e}")
+        return ()
+    # まだ大会ごとのシートに分けていない大会は共有シートから
+    snap = load_snapshot()
+    _, by_comp = _comp_index(snap.generation(*_deps("start_list")), "start_list", snap)
+    # comp_id が一致するものだけ (文字列にして比較)
+    return by_comp.get(str(comp_id), ())
 
-def save_start_list_overwrite(comp_id, data_list):
-    """ 指定された大会のスタートリストを上書き保存する """
-    wb = get_sheet()
-    if not wb: return False
+def load_start_list_rows(comp_id):
+    """
+    load_start_list と同じ順で、各行のシート上の行番号 (差分保存用)。
+    大会ごとのシートに分けていない大会は None (全体保存で分ける)
+    """
+    try:
+        entry, rows = _start_list_partition(comp_id)
+    except quota.Throttled:
+        _show_throttled()
+    except Exception as e:
+        _handle_error(e)
+        print(f"Load Start List Error: {e}")
+        return None
+    if not entry: return None
+    return [n for n, _ in rows]
+
+def _cell(v):
+    """ data_editor の値をセルに書ける形にする (None / NaN は空欄) """
+    if v is None or (isinstance(v, float) and v != v): return ""
+    return v
+
+def save_start_list_changes(comp_id, row_nums, changes):
+    """
+    st.data_editor の変更分 (utils.editor_changes) だけを書き込む。
+    row_nums は編集前の各行のシート行番号 (load_start_list_rows)。
+    変更したセルと削除した行 (空欄にする) は1回のまとめ書き、追加した行は末尾に追記する。
+    """
     try:
-        try: sheet = wb.worksheet("start_list")
-        except: sheet = wb.add_worksheet("start_list", 1000, 20)
+        store = get_storage()
+        entry = _sl_catalog_entry(comp_id)
+        if not entry: return False
+        sheet = str(entry["sheet"])
+        edited, added, deleted = changes["edited_rows"], changes["added_rows"], set(changes["deleted_rows"])
+        
+        # 新しい列が入力されていればヘッダーに追加
+        header = store.get_header(sheet)
+        cols = {c for vals in edited.values() for c in vals} | {c for r in added for c in r}
+        missing = [c for c in cols if c not in header]
+        if missing or not header:
+            header = store.ensure_header(sheet, (header or ["comp_id"]) + missing)
         
-        # 1. 既存データを全取得
-        all_records = sheet.get_all_records()
+        cells = []
+        for i, vals in edited.items():
+            if i in deleted or i >= len(row_nums): continue
+            cells += [(row_nums[i], c, _cell(v)) for c, v in vals.items()]
+        for i in deleted:
+            if i < len(row_nums): cells += [(row_nums[i], c, "") for c in header]
+        store.update_cells(sheet, cells)
+        
+        new_rows = []
+        for r in added:
+            r = dict(r, comp_id=str(comp_id))
+            new_rows.append([_cell(r.get(c, "")) for c in header])
+        store.append_rows(sheet, new_rows)
         
-        # 2. 今回保存する大会以外のデータは残す
+        if cells or new_rows:
+            _touch_sl_catalog(store, comp_id, sheet)
+            invalidate()
+        return True
+    except Exception as e:
+        _handle_error(e)
+        st.error(f"Save Start List Error: {e}")
+        return False
+
+def _sl_sheets(comp_id):
+    """ 全体保存の (書き込むシート = 目録が指していない方, 今のシート or None) """
+    entry = _sl_catalog_entry(comp_id)
+    current = str(entry["sheet"]) if entry else None
+    sheets = [storage.partition_name("start_list", comp_id), storage.partition_name("start_list", f"{comp_id}_b")]
+    return (sheets[1] if current == sheets[0] else sheets[0]), current
+
+def save_start_list_overwrite(comp_id, data_list):
+    """ 指定された大会のスタートリストを上書き保存する (今読まれていない方のシートに書いてから目録を付け替える) """
+    try:
+        store = get_storage()
         target_str = str(comp_id)
-        kept_records = [r for r in all_records if str(r.get("comp_id")) != target_str]
+        sheet, previous = _sl_sheets(target_str)
         
-        # 3. 新しいデータを追加（comp_idを付与）
-        for row in data_list:
-            row["comp_id"] = target_str
-            kept_records.append(row)
+        # comp_id を付与して、決まった列順のヘッダーで書き込む
+        records = [dict(row, comp_id=target_str) for row in data_list]
+        header = _sl_header(k for r in records for k in r)
+        store.overwrite(sheet, header, [[r.get(col, "") for col in header] for r in records])
         
-        # 4. シートをクリアして全書き込み
-        if kept_records:
-            header = list(kept_records[0].keys())
-            # 順番を整えるための固定ヘッダー定義
-            preferred_order = ["comp_id", "競技始", "種目", "組", "レーン", "ナンバー", "氏名", "現PB", "目標記録", "所属", "招集始", "招集終", "備考"]
-            # データに含まれるキーだけでヘッダーを作る
-            final_header = [h for h in preferred_order if h in header] + [h for h in header if h not in preferred_order]
-            
-            rows = [final_header]
-            for r in kept_records:
-                rows.append([r.get(col, "") for col in final_header])
-            
-            sheet.clear()
-            sheet.update(rows)
-        else:
-            sheet.clear() # データが空になった場合
-            
-        load_start_list.clear() # キャッシュクリア
+        # 書き終えてから目録を付け替える (途中で失敗しても目録は前のシートを指したまま)
+        _touch_sl_catalog(store, target_str, sheet)
+        # 付け替えられたら前のシートは空にする (ヘッダーだけ残す。失敗しても保存はできている)
+        if previous and previous != sheet:
+            try: store.overwrite(previous, header, [])
+            except Exception as e: print(f"Clear Start List Error: {e}")
+        invalidate() # キャッシュクリア
         return True
     except Exception as e:
+        _handle_error(e)
         st.error(f"Save Start List Error: {e}")
         return False
 
+def split_start_list(store=None):
+    """
+    共有シート start_list の行を大会ごとのシートに移して目録に載せ、共有シートを空にする
+    (manage.py split-start-list)。既に目録にある大会の行は古いので移さない。
+    (移した大会数, 行数) を返す
+    """
+    store = store or get_storage()
+    values = store.get_values("start_list")
+    if not values: return 0, 0
+    header = list(values[0])
+    while header and header[-1] == "": header.pop()
+    if "comp_id" not in header: return 0, 0
+    done = {str(r.get("comp_id")) for r in store.get_records(SL_CATALOG)}
+    
+    # シートの値を文字列のまま大会ごとに振り分ける (先頭ゼロなどを崩さない)
+    by_comp = {}
+    for row in values[1:]:
+        row = (list(row) + [""] * len(header))[:len(header)]
+        cid = str(row[header.index("comp_id")])
+        if not cid or cid in done: continue
+        by_comp.setdefault(cid, []).append(row)
+    
+    sl_header = _sl_header(header)
+    order = [header.index(c) for c in sl_header]
+    for cid, rows in by_comp.items():
+        sheet = storage.partition_name("start_list", cid)
+        store.overwrite(sheet, sl_header, [[r[i] for i in order] for r in rows])
+        _touch_sl_catalog(store, cid, sheet)
+    # 全部移せてから共有シートを空にする (ヘッダーだけ残す)
+    store.overwrite("start_list", header, [])
+    invalidate()
+    return len(by_comp), sum(len(rows) for rows in by_comp.values())
+
 ###########################################################################
 ###########################################################################
 # get_user_best_in_period, News, Blog, Accountingなどは既存を使用してください
-@st.cache_data(ttl=5)
 def load_fees():
     """ 集金イベント一覧を読み込む """
-    wb = get_sheet()
-    if not wb: return []
+    snap = load_snapshot()
+    return _fees_view(snap.generation("accounting"), snap)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _fees_view(generation, _snap):
     try:
-        try: sheet = wb.worksheet("accounting")
-        except: return []
-        
-        records = sheet.get_all_records()
+        records = _snap.records("accounting")
         # status_map (誰が払ったか) はJSONなので復元
         for r in records:
             if isinstance(r.get("status_map"), str):
                 try: r["status_map"] = json.loads(r["status_map"].replace("'", '"'))
                 except: r["status_map"] = {}
-        return records
-    except:
-        return []
+        return storage.freeze(records)
+    except Exception as e:
+        print(e)
+        return ()
+
+def update_fee_status(fee_id, changed):
+    """
+    集金の支払状況のうち、変更した人の分 (changed = {uid: "済" / "未納"}) だけを反映し、
+    status_map のセル1つだけを書き換える。
+    """
+    try:
+        fee = next((f for f in load_fees() if str(f.get("id")) == str(fee_id)), None)
+        if not fee: return False
+        status_map = dict(fee.get("status_map") or {})
+        status_map.update(changed)
+        _write([Write("accounting", {"id": str(fee_id)}, {"status_map": json.dumps(status_map, ensure_ascii=False)}, "update")])
+        return True
+    except Exception as e:
+        _handle_error(e)
+        print(f"Fee Save Error: {e}")
+        return False
 
 def save_fee_event(fee_data):
     """ 新しい集金イベントを作成・更新 """
-    wb = get_sheet()
-    if not wb: return False
     try:
-        try: sheet = wb.worksheet("accounting")
-        except: sheet = wb.add_worksheet("accounting", 1000, 10)
-        
-        # 既存データを全取得
-        all_records = sheet.get_all_records()
-        
         # IDが一致するものがあれば更新、なければ追加
         target_id = str(fee_data["id"])
-        updated = False
         
         # 保存用にデータを整形
         save_row = {
@@ -558,176 +1182,93 @@ def save_fee_event(fee_data):
             "status_map": json.dumps(fee_data["status_map"], ensure_ascii=False)
         }
         
-        # ヘッダー確認 & 行構築
-        header = ["id", "title", "amount", "deadline", "status_map"]
-        
-        # シートが空ならヘッダー追加
-        if not all_records and sheet.row_values(1) == []:
-            sheet.append_row(header)
-            all_records = []
-
-        # 更新対象を探す
-        target_row_idx = -1
-        for i, r in enumerate(all_records):
-            if str(r.get("id")) == target_id:
-                target_row_idx = i + 2 # 1行目ヘッダー + 0始まり補正
-                break
-        
-        row_vals = [save_row[h] for h in header]
-        
-        if target_row_idx > 0:
-            # 更新 (A列～E列)
-            sheet.update(f"A{target_row_idx}:E{target_row_idx}", [row_vals])
-        else:
-            # 新規追加
-            sheet.append_row(row_vals)
-            
-        load_fees.clear()
+        # 同じ ID の行を書き換え、無ければ追加 (書き込みキュー経由)
+        _write([Write("accounting", {"id": target_id}, save_row)])
         return True
     except Exception as e:
+        _handle_error(e)
         print(f"Fee Save Error: {e}")
         return False
     
 # db.py に追加・修正
 
 # === 📢 公式News (自動生成される結果報告) ===
-@st.cache_data(ttl=10)
 def load_news():
-    wb = get_sheet()
-    if not wb: return []
+    snap = load_snapshot()
+    return _news_view(snap.generation("news"), snap)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _news_view(generation, _snap):
     try:
         # シート名を 'news' に変更
-        try: sheet = wb.worksheet("news")
-        except: return []
-        records = sheet.get_all_records()
-        records.sort(key=lambda x: x.get("date", ""), reverse=True)
-        return records
-    except: return []
+        records = sorted(_snap.tables.get("news", ()), key=lambda x: x.get("date", ""), reverse=True)
+        return storage.freeze(records)
+    except Exception as e:
+        print(e)
+        return ()
 
 def save_news(news_data):
     """ Newsを保存 (ID, date, title, content) """
-    wb = get_sheet()
-    if not wb: return False
     try:
-        try: sheet = wb.worksheet("news")
-        except: sheet = wb.add_worksheet("news", 1000, 10)
-        
-        # ヘッダー確認
-        if not sheet.get_all_values():
-            sheet.append_row(["id", "date", "title", "content"]) # 画像や著者は不要
-            
-        sheet.append_row([
-            news_data["id"], 
-            news_data["date"], 
-            news_data["title"], 
-            news_data["content"]
-        ])
-        load_news.clear()
+        # 画像や著者は不要 (書き込みキュー経由で追加)
+        row = {
+            "id": news_data["id"], 
+            "date": news_data["date"], 
+            "title": news_data["title"], 
+            "content": news_data["content"]
+        }
+        _write([Write("news", {"id": row["id"]}, row, "insert")])
         return True
-    except: return False
+    except Exception as e:
+        _handle_error(e)
+        return False
 
 # === 📝 選手ブログ ===
-@st.cache_data(ttl=10)
 def load_blogs():
-    wb = get_sheet()
-    if not wb: return []
+    snap = load_snapshot()
+    return _blogs_view(snap.generation("blogs"), snap)
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _blogs_view(generation, _snap):
     try:
-        try: sheet = wb.worksheet("blogs")
-        except: return []
-        records = sheet.get_all_records()
-        records.sort(key=lambda x: str(x.get("created_at", "")), reverse=True)
-        return records
-    except: return []
+        records = sorted(_snap.tables.get("blogs", ()), key=lambda x: str(x.get("created_at", "")), reverse=True)
+        return storage.freeze(records)
+    except Exception as e:
+        print(e)
+        return ()
 
 def save_blog(blog_data):
     """ ブログを保存 """
-    wb = get_sheet()
-    if not wb: return False
     try:
-        try: sheet = wb.worksheet("blogs")
-        except: sheet = wb.add_worksheet("blogs", 1000, 10)
-        
-        header = ["id", "created_at", "title", "content", "author_name", "author_id", "image"]
-        if not sheet.get_all_values(): sheet.append_row(header)
-        
-        # 新規追加のみ実装（編集は省略）
-        sheet.append_row([
-            blog_data["id"],
-            blog_data["created_at"],
-            blog_data["title"],
-            blog_data["content"],
-            blog_data["author_name"],
-            blog_data["author_id"],
-            blog_data.get("image", "")
-        ])
-        load_blogs.clear()
+        # 新規追加のみ実装（編集は省略）。書き込みキュー経由で追加
+        row = {
+            "id": blog_data["id"],
+            "created_at": blog_data["created_at"],
+            "title": blog_data["title"],
+            "content": blog_data["content"],
+            "author_name": blog_data["author_name"],
+            "author_id": blog_data["author_id"],
+            "image": blog_data.get("image", "")
+        }
+        _write([Write("blogs", {"id": row["id"]}, row, "insert")])
         return True
-    except: return False
+    except Exception as e:
+        _handle_error(e)
+        return False
 
 # --- db.py の末尾に追加 ---
 
+@st.cache_resource(max_entries=4, show_spinner=False)
+def _best_mark_index(generation, _snap):
+    rows, _ = _comp_index(generation, "results", _snap)
+    return results_index.BestMarkIndex(rows)
+
 def get_user_best_in_period(user_id, event, start_date=None, end_date=None):
     """
     指定された期間内での、特定のユーザー・種目のベスト記録データを返します。
     （トラック種目はタイムの最小値、フィールド種目は距離の最大値をベストとみなします）
+    (user_id, event) ごとの索引から二分探索で引くので、全リザルトは舐めません。
     """
-    # 1. 全リザルトを読み込む
-    results = load_results(None)
-    
-    # 2. 対象の記録をフィルタリング（抽出）
-    targets = []
-    for r in results:
-        # IDチェック
-        if str(r.get("user_id")) != str(user_id): continue
-        # 種目チェック
-        if r.get("event") != event: continue
-        
-        # 日付チェック（期間指定がある場合のみ）
-        r_date = r.get("date") # "YYYY-MM-DD"形式
-        if not r_date: continue
-        
-        if start_date and r_date < start_date: continue
-        if end_date and r_date > end_date: continue
-        
-        targets.append(r)
-
-    if not targets:
-        return None
-
-    # 3. ベスト記録を選定するロジック
-    best_record = None
-    best_val = None
-    
-    # 簡易判定: 種目名に特定の文字が含まれる場合は「フィールド種目（大きい方が良い）」とする
-    # それ以外は「トラック種目（小さい方が良い）」とする
-    is_field = False
-    field_keywords = ["跳", "投", "砲丸", "円盤", "やり", "ハンマー", "ジャベリックス"]
-    for k in field_keywords:
-        if k in event:
-            is_field = True
-            break
-
-    for r in targets:
-        try:
-            # 記録を数値に変換してみる
-            val = float(str(r["result"]).strip())
-        except:
-            # 数値にできないもの（DNS, NM, 欠場など）はスキップ
-            continue
-
-        if best_val is None:
-            best_val = val
-            best_record = r
-        else:
-            if is_field:
-                # フィールド: 数値が大きい方が良い
-                if val > best_val:
-                    best_val = val
-                    best_record = r
-            else:
-                # トラック: 数値（タイム）が小さい方が良い
-                if val < best_val:
-                    best_val = val
-                    best_record = r
-                    
-    return best_record
\ No newline at end of file
+    snap = load_snapshot()
+    best = _best_mark_index(snap.generation(*RESULTS_DEPS), snap).best(user_id, event, start_date, end_date)
+    return dict(best) if best else None
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""
+管理用コマンド
+
+  python manage.py sync sheets sqlite    # スプレッドシート -> ローカル SQLite に複製
+  python manage.py sync sqlite sheets --force
+  python manage.py backfill-marks          # results の mark_value / mark_status を埋める
+  python manage.py compact-results         # results の重複行をまとめる (--dry-run で件数だけ表示)
+  python manage.py split-start-list        # 共有の start_list を大会ごとのシートに分ける
+  python manage.py freeze-season 2024      # 締めた年度のリザルトをローカルのアーカイブに移す
+
+SQLite のファイルは TF_SQLITE_PATH か secrets.toml の [storage] sqlite_path (既定: tf_fast.db)。
+"""
+import argparse
+import sys
+import storage
+import db
+import archive
+import quota
+
+
+def cmd_sync(args):
+    _, path = storage._config()
+    path = args.sqlite_path or path
+    if args.dst == "sheets" and not args.force:
+        # スプレッドシートは部員が編集する本体なので、上書きは明示したときだけ
+        print("スプレッドシートを上書きします。実行するには --force を付けてください。", file=sys.stderr)
+        return 1
+    src = storage.open_storage(args.src, path)
+    dst = storage.open_storage(args.dst, path)
+    for table, n in storage.sync(src, dst, args.tables or None):
+        print(f"{table}: {n} rows")
+    return 0
+
+
+def cmd_backfill_marks(args):
+    backend, path = storage._config()
+    store = storage.open_storage(args.backend or backend, args.sqlite_path or path)
+    n = db.backfill_result_marks(store, recompute=args.all)
+    print(f"results: {n} rows updated")
+    return 0
+
+
+def cmd_compact_results(args):
+    backend, path = storage._config()
+    store = storage.open_storage(args.backend or backend, args.sqlite_path or path)
+    before, after = db.compact_results(store, dry_run=args.dry_run)
+    note = " (dry run: 書き込みなし)" if args.dry_run else ""
+    print(f"results: {before} rows -> {after} rows{note}")
+    return 0
+
+
+def cmd_split_start_list(args):
+    backend, path = storage._config()
+    store = storage.open_storage(args.backend or backend, args.sqlite_path or path)
+    comps, n = db.split_start_list(store)
+    print(f"start_list: {n} rows -> {comps} competitions")
+    return 0
+
+
+def cmd_freeze_season(args):
+    backend, path = storage._config()
+    store = storage.open_storage(args.backend or backend, args.sqlite_path or path)
+    n = db.freeze_results_season(args.season, store, dry_run=args.dry_run)
+    note = " (dry run: 書き込みなし)" if args.dry_run else ""
+    print(f"results: {args.season}年度の {n} rows -> {archive.archive_dir()}{note}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="manage.py", description="UEC T&F Portal 管理コマンド")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("sync", help="バックエンド間でテーブルを丸ごと複製する")
+    p.add_argument("src", choices=["sheets", "sqlite"])
+    p.add_argument("dst", choices=["sheets", "sqlite"])
+    p.add_argument("--tables", nargs="*", choices=list(storage.TABLES), help="対象テーブル (省略時は全部)")
+    p.add_argument("--sqlite-path", help="SQLite ファイルのパス")
+    p.add_argument("--force", action="store_true", help="スプレッドシートへの上書きを許可する")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser("backfill-marks", help="既存リザルトの数値化した記録 (mark_value / mark_status) を埋める")
+    p.add_argument("--backend", choices=["sheets", "sqlite"], help="対象 (省略時は設定どおり)")
+    p.add_argument("--sqlite-path", help="SQLite ファイルのパス")
+    p.add_argument("--all", action="store_true", help="埋まっている行も計算し直す")
+    p.set_defaults(func=cmd_backfill_marks)
+
+    p = sub.add_parser("compact-results", help="results の重複行 (同じ大会・選手・種目・ラウンド・組) をまとめる")
+    p.add_argument("--backend", choices=["sheets", "sqlite"], help="対象 (省略時は設定どおり)")
+    p.add_argument("--sqlite-path", help="SQLite ファイルのパス")
+    p.add_argument("--dry-run", action="store_true", help="書き込まずに件数だけ表示する")
+    p.set_defaults(func=cmd_compact_results)
+
+    p = sub.add_parser("split-start-list", help="共有の start_list シートを大会ごとのシートに分ける")
+    p.add_argument("--backend", choices=["sheets", "sqlite"], help="対象 (省略時は設定どおり)")
+    p.add_argument("--sqlite-path", help="SQLite ファイルのパス")
+    p.set_defaults(func=cmd_split_start_list)
+
+    p = sub.add_parser("freeze-season", help="締めた年度のリザルトをシートからローカルのアーカイブ (Parquet) に移す")
+    p.add_argument("season", type=int, help="年度 (4月始まり。例: 2024 = 2024年4月〜2025年3月)")
+    p.add_argument("--backend", choices=["sheets", "sqlite"], help="対象 (省略時は設定どおり)")
+    p.add_argument("--sqlite-path", help="SQLite ファイルのパス")
+    p.add_argument("--dry-run", action="store_true", help="書き込まずに件数だけ表示する")
+    p.set_defaults(func=cmd_freeze_season)
+
+    args = parser.parse_args(argv)
+    if args.command == "sync" and args.src == args.dst:
+        parser.error("src と dst が同じです")
+    # 管理コマンドは画面の読み込みより後回しでよい (混んでいるときは長めに待って再試行する)
+    with quota.background():
+        return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import streamlit as st
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+import gspread
+from gspread.http_client import HTTPClient as _BaseHTTPClient
+
+# ==========================================
+# Sheets API の呼び出し回数の制御
+# ==========================================
+# Sheets API には「1分あたりの読み込み / 書き込みリクエスト数」の上限 (既定: サービスアカウント1つで各 60回) があり、
+# 超えると 429 が返る。全ての呼び出しをここのトークンバケットに通し、上限を超えないように待たせる。
+#  - 画面を開いた人の読み込み (interactive) を先に通し、裏の取り直し・書き込みキュー (background) は
+#    バケットに余裕 (RESERVE) があるときだけ通す
+#  - 429 / 5xx が返ったら、ゆらぎ (jitter) を入れた指数バックオフで再試行する。429 のときは
+#    バケットを空にして、他のスレッドも一緒に待たせる (一斉に再試行しない)
+#  - それでも通らなければ Throttled を投げる (「データがありません」ではなく「混雑中」と表示するため)
+
+READ_PER_MIN = 60    # 1分あたりの読み込みリクエスト数の上限
+WRITE_PER_MIN = 60   # 1分あたりの書き込みリクエスト数の上限
+USE_RATIO = 0.8      # 上限のうち実際に使う割合 (他の利用者・手作業の分を残す)
+BURST = 10           # 続けて出せるリクエスト数
+RESERVE = 3          # background が使わずに残しておくトークン数 (画面の読み込み用)
+
+INTERACTIVE_WAIT = 10   # 画面の読み込みがトークンを待つ最大秒数
+BACKGROUND_WAIT = 120
+INTERACTIVE_RETRIES = 2 # 429 / 5xx のときの再試行回数
+BACKGROUND_RETRIES = 6
+BACKOFF_BASE = 1
+BACKOFF_MAX = 64
+
+RETRY_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class Throttled(Exception):
+    """ API の上限に達していて、待っても通らなかった """
+
+
+def config():
+    """
+    secrets.toml の [storage] または環境変数で上限を変える。
+      read_per_minute = 60
+      write_per_minute = 60
+    環境変数 TF_READ_PER_MIN / TF_WRITE_PER_MIN があればそちらを優先。
+    (読み込み, 書き込み) を返す
+    """
+    conf = {}
+    try: conf = dict(st.secrets.get("storage", {}))
+    except Exception: pass # secrets.toml が無い (テスト・CLI) 場合
+    read = os.environ.get("TF_READ_PER_MIN") or conf.get("read_per_minute", READ_PER_MIN)
+    write = os.environ.get("TF_WRITE_PER_MIN") or conf.get("write_per_minute", WRITE_PER_MIN)
+    return float(read), float(write)
+
+
+# --- 優先度 ---
+_local = threading.local()
+
+def is_background():
+    return getattr(_local, "background", False)
+
+@contextmanager
+def background():
+    """ この中で出すリクエストは後回しでよいもの (裏の取り直し・書き込みキュー・管理コマンド) """
+    prev = is_background()
+    _local.background = True
+    try: yield
+    finally: _local.background = prev
+
+
+# --- トークンバケット ---
+class TokenBucket:
+    def __init__(self, per_minute, burst=BURST, reserve=RESERVE):
+        self.rate = per_minute * USE_RATIO / 60.0 # 1秒あたりに増えるトークン
+        self.burst = burst
+        self.reserve = reserve
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._cond = threading.Condition()
+        self._waiting = 0 # トークンを待っている interactive の数
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, background=False, timeout=None):
+        """ トークンを1つ取る。timeout 秒待っても取れなければ Throttled """
+        deadline = time.monotonic() + (timeout if timeout is not None else (BACKGROUND_WAIT if background else INTERACTIVE_WAIT))
+        with self._cond:
+            if not background: self._waiting += 1
+            try:
+                while True:
+                    self._refill()
+                    # background は interactive が待っていない & 予備を残せるときだけ
+                    need = 1 + self.reserve if background else 1
+                    if self._tokens >= need and not (background and self._waiting):
+                        self._tokens -= 1
+                        return
+                    left = deadline - time.monotonic()
+                    if left <= 0: raise Throttled("Sheets API の呼び出しが混み合っています")
+                    self._cond.wait(min(left, max(0.05, (need - self._tokens) / self.rate)))
+            finally:
+                if not background:
+                    self._waiting -= 1
+                    self._cond.notify_all()
+
+    def penalize(self, seconds):
+        """ 429 を受けたとき: 全員 seconds 秒は待つようにバケットを空にする """
+        with self._cond:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def bucket(kind):
+    """ "read" / "write" のバケット (プロセスで1つずつ) """
+    with _buckets_lock:
+        if kind not in _buckets:
+            read, write = config()
+            _buckets[kind] = TokenBucket(read if kind == "read" else write)
+        return _buckets[kind]
+
+
+def backoff(attempt, retry_after=None):
+    """ attempt 回目の再試行までの秒数 (指数バックオフ + full jitter)。Retry-After があればそれ以上待つ """
+    wait = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    if retry_after: wait = max(wait, retry_after)
+    return wait
+
+
+def _retry_after(response):
+    try: return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError): return None
+
+
+# --- gspread の HTTP クライアント ---
+class HTTPClient(_BaseHTTPClient):
+    """
+    gspread.authorize(creds, http_client=quota.HTTPClient) で使う。
+    Sheets API へのリクエストはすべてバケットを通し、429 / 5xx は待って再試行する
+    (Drive API など他の API は上限が別なのでそのまま通す)
+    """
+    def request(self, method, endpoint, *args, **kwargs):
+        if "sheets.googleapis.com" not in endpoint:
+            return super().request(method, endpoint, *args, **kwargs)
+        bg = is_background()
+        b = bucket("read" if method.upper() == "GET" else "write")
+        retries = BACKGROUND_RETRIES if bg else INTERACTIVE_RETRIES
+        for attempt in range(retries + 1):
+            b.acquire(bg)
+            try:
+                return super().request(method, endpoint, *args, **kwargs)
+            except gspread.exceptions.APIError as e:
+                code = e.response.status_code
+                if code not in RETRY_CODES: raise
+                if attempt == retries: raise Throttled(f"Sheets API が応答しません ({code})") from e
+                wait = backoff(attempt, _retry_after(e.response))
+                # 429 はバケットごと待たせる (次の acquire で待つ)。それ以外はこのリクエストだけ待つ
+                if code == 429: b.penalize(wait)
+                else: time.sleep(wait)
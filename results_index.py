@@ -0,0 +1,310 @@
+import bisect
+import threading
+import utils
+
+# ==========================================
+# リザルトの索引 (スナップショットごとに1回だけ作る)
+# ==========================================
+# 画面ごとに全リザルトを舐め直さないよう、よく使う問い合わせ用の索引をまとめて作る。
+# 元になる行 (db.load_results と同じ形の辞書) は書き換えずに共有する。
+
+
+def mark_values(rows):
+    """
+    各行の数値化した記録のリスト (読めないものは None)。
+    保存時に書いた mark_value があればそれを使い、無い行 (古い行) だけ result を一括で解析する。
+    """
+    marks = [None] * len(rows)
+    missing = []
+    for i, r in enumerate(rows):
+        v = r.get("mark_value")
+        if isinstance(v, (int, float)) and not isinstance(v, bool): marks[i] = float(v)
+        elif r.get("mark_status") not in utils.RECORD_STATUSES: missing.append(i)
+    if missing:
+        parsed = utils.parse_record_series([rows[i].get("result") for i in missing]).tolist()
+        for i, v in zip(missing, parsed):
+            if v == v: marks[i] = v # NaN は None のまま
+    return marks
+
+
+# --- 選手ごとのリザルト ---
+def by_user(results):
+    """
+    user_id -> その選手のリザルト (日付順、同じ日はシートの順)。
+    各行には数値化した記録 record_val (読めなければ None) を付けておく。
+    """
+    index = {}
+    for r in results:
+        row = dict(r)
+        row["record_val"] = r.get("mark_value")
+        index.setdefault(str(row.get("user_id")), []).append(row)
+    for rows in index.values():
+        rows.sort(key=lambda x: str(x.get("date", "")))
+    return index
+
+
+# --- 期間内ベスト ---
+class _MarkSeries:
+    """
+    1人・1種目の記録を日付順に並べたもの。
+    区間の最良記録はスパーステーブル (table[k][i] = i から 2^k 件の中で最良の位置) で O(1) で答える。
+    """
+    def __init__(self, items, info):
+        # 同じ日付の記録はシートの順番のまま (安定ソート)
+        items.sort(key=lambda x: x[0])
+        self.dates = [d for d, _, _ in items]
+        self.marks = [v for _, v, _ in items]
+        self.rows = [r for _, _, r in items]
+        self.better = info.better
+        n = len(items)
+        table = [list(range(n))]
+        k = 1
+        while (1 << k) <= n:
+            prev, half = table[-1], 1 << (k - 1)
+            table.append([self._better(prev[i], prev[i + half]) for i in range(n - (1 << k) + 1)])
+            k += 1
+        self.table = table
+
+    def _better(self, i, j):
+        """ 同じ記録なら先の方 (i) を残す """
+        return j if self.better(self.marks[j], self.marks[i]) else i
+
+    def best(self, start_date=None, end_date=None):
+        lo = bisect.bisect_left(self.dates, start_date) if start_date else 0
+        hi = bisect.bisect_right(self.dates, end_date) if end_date else len(self.dates)
+        if lo >= hi: return None
+        k = (hi - lo).bit_length() - 1
+        row = self.table[k]
+        return self.rows[self._better(row[lo], row[hi - (1 << k)])]
+
+
+class BestMarkIndex:
+    """ (user_id, event) -> 日付順・数値化済みの記録 """
+    def __init__(self, results):
+        groups = {}
+        for r in results:
+            date = r.get("date")
+            if not date: continue
+            val = r.get("mark_value")
+            if val is None: continue
+            groups.setdefault((str(r.get("user_id")), r.get("event")), []).append((date, val, r))
+        self._series = {
+            key: _MarkSeries(items, utils.event_info(key[1])) for key, items in groups.items()
+        }
+
+    def best(self, user_id, event, start_date=None, end_date=None):
+        """ 期間 [start_date, end_date] (両端含む, "YYYY-MM-DD") のベスト記録の行。無ければ None """
+        s = self._series.get((str(user_id), event))
+        if s is None: return None
+        return s.best(start_date, end_date)
+
+
+# ==========================================
+# 種目別ランキング (書き込みの差分だけ反映する)
+# ==========================================
+# 種目ごとに「通算」「年度別」と、それぞれの「1人1記録 (自己ベストのみ)」の上位 TOP_K 件を持つ。
+# リザルトは追記なので、新しい行を足すだけで上位は正しく保てる (上位から外れた行が戻ることはない)。
+# 途中の行の編集・削除や大会日付の変更があったときは全体から作り直す。
+TOP_K = 50
+
+
+def season_of(date):
+    """ "YYYY-MM-DD" -> 年度 (4月始まり)。読めなければ None """
+    try: y, m = int(str(date)[:4]), int(str(date)[5:7])
+    except ValueError: return None
+    return y if m >= 4 else y - 1
+
+
+class _Board:
+    """ 上位 k 件。key は小さいほど良い (記録, 通し番号) """
+    def __init__(self, k, per_athlete):
+        self.k = k
+        self.keys = []
+        self.rows = []
+        self.athlete_best = {} if per_athlete else None # user_id -> その人のベストの key
+
+    def offer(self, key, row):
+        if self.athlete_best is not None:
+            uid = str(row.get("user_id"))
+            old = self.athlete_best.get(uid)
+            if old is not None and old <= key: return
+            self.athlete_best[uid] = key
+            if old is not None:
+                i = bisect.bisect_left(self.keys, old)
+                if i < len(self.keys) and self.keys[i] == old:
+                    del self.keys[i], self.rows[i]
+        if len(self.keys) >= self.k and key >= self.keys[-1]: return
+        i = bisect.bisect_left(self.keys, key)
+        self.keys.insert(i, key)
+        self.rows.insert(i, row)
+        if len(self.keys) > self.k:
+            self.keys.pop()
+            self.rows.pop()
+
+
+class _Derived:
+    """
+    results から作る集計の共通部分。書き込んだ行 (add) と新しいスナップショット (catch_up) の
+    差分だけを反映し、追記以外の変更があったときは全体から作り直す。
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset({})
+
+    def _reset(self, comp_dates):
+        self.comp_dates = comp_dates  # comp_id -> 開催日 (年度の判定用)
+        self._seen = set()            # 反映済みの result_id
+        self.version = None           # 最後に追いついたスナップショット
+        self._rows = ()               # そのとき取り込んだ results の行 (差分かどうかの判定用)
+        self._clear()
+
+    def _clear(self):
+        raise NotImplementedError
+
+    def _apply(self, row, event, val, season):
+        """ 1行を反映する (val は数値化した記録。読めなければ None) """
+        raise NotImplementedError
+
+    def add(self, rows):
+        """ 新しいリザルト行 (シートの生の行) を反映する。反映済みの result_id は無視する """
+        with self._lock:
+            self._add(rows)
+
+    def _add(self, rows):
+        for r, val in zip(rows, mark_values(rows)):
+            rid = str(r.get("result_id", ""))
+            if rid:
+                if rid in self._seen: continue
+                self._seen.add(rid)
+            season = season_of(self.comp_dates.get(str(r.get("comp_id", ""))))
+            self._apply(r, str(r.get("event", "")), val, season)
+
+    def catch_up(self, version, raw, comp_dates):
+        """
+        スナップショットの results (raw) に追いつく。前回取り込んだ行がそのまま先頭に
+        残っていれば (= 追記だけなら) 増えた行だけを足し、そうでなければ作り直す。
+        """
+        with self._lock:
+            if version == self.version: return
+            n = len(self._rows)
+            # 行は同じものが引き継がれる (Snapshot.build) ので、中身ではなく同じものかどうかで比べる
+            appended = comp_dates == self.comp_dates and len(raw) >= n and all(a is b for a, b in zip(raw, self._rows))
+            if not appended:
+                self._reset(comp_dates)
+                n = 0
+            self._add(raw[n:])
+            self.version = version
+            self._rows = raw
+
+
+class Leaderboards(_Derived):
+    def __init__(self, k=TOP_K):
+        self.k = k
+        super().__init__()
+
+    def _clear(self):
+        self._boards = {} # (種目, 年度 or None, 1人1記録か) -> _Board
+        self._seq = 0
+        self.events = set()
+        self.seasons = set()
+
+    def _apply(self, row, event, val, season):
+        self.events.add(event)
+        if val is None: return
+        self._seq += 1
+        key = (utils.event_info(event).sort_key(val), self._seq)
+        scopes = [None]
+        if season is not None:
+            self.seasons.add(season)
+            scopes.append(season)
+        for scope in scopes:
+            for per_athlete in (False, True):
+                b = self._boards.get((event, scope, per_athlete))
+                if b is None: b = self._boards[(event, scope, per_athlete)] = _Board(self.k, per_athlete)
+                b.offer(key, row)
+
+    def top(self, event, season=None, per_athlete=False, n=5):
+        """ 上位 n 件の行 (良い順)。season は年度 (None で通算) """
+        with self._lock:
+            b = self._boards.get((event, season, per_athlete))
+            return list(b.rows[:n]) if b else []
+
+
+# ==========================================
+# 自己ベスト (PB) ・シーズンベスト (SB)
+# ==========================================
+# (user_id, event) ごとの部内での自己ベストと、年度ごとのベスト。
+# ベストは良くなる方向にしか変わらないので、ランキングと同じく追記分だけ反映すればよい。
+
+
+class PersonalBests(_Derived):
+    def _clear(self):
+        self._pb = {} # user_id -> {種目: (記録, 行)}
+        self._sb = {} # user_id -> {(種目, 年度): (記録, 行)}
+
+    def _apply(self, row, event, val, season):
+        if val is None: return
+        better = utils.event_info(event).better
+        uid = str(row.get("user_id"))
+        pbs = self._pb.setdefault(uid, {})
+        if event not in pbs or better(val, pbs[event][0]): pbs[event] = (val, row)
+        if season is None: return
+        sbs = self._sb.setdefault(uid, {})
+        k = (event, season)
+        if k not in sbs or better(val, sbs[k][0]): sbs[k] = (val, row)
+
+    def user_bests(self, user_id):
+        """ その選手の {種目: PB の行} """
+        with self._lock:
+            return {ev: row for ev, (_, row) in self._pb.get(str(user_id), {}).items()}
+
+    def season_best(self, user_id, event, season):
+        with self._lock:
+            hit = self._sb.get(str(user_id), {}).get((event, season))
+            return hit[1] if hit else None
+
+    def flags(self, rows, history=None):
+        """
+        これから保存する行それぞれについて "PB" / "SB" / "" を返す (表は変更しない)。
+        比べる相手が既にいるときだけ付ける (初めての記録には付けない)。
+        同じバッチ内の行は前から順に反映したものとして判定する。
+        history = {(user_id, 種目): [行, ...]} を渡すと、その選手・種目は表ではなくその行と比べる
+        (書き換える行の元の内容を比べる相手から外すため)。
+        """
+        with self._lock:
+            # history の行から作った比べる相手 (これがあれば表より先に使う)
+            pending_pb, pending_sb = {}, {}
+            for (uid, event), hist in (history or {}).items():
+                better = utils.event_info(event).better
+                pending_pb.setdefault((uid, event), None)
+                for r, val in zip(hist, mark_values(hist)):
+                    if val is None: continue
+                    pk = (uid, event)
+                    if pending_pb[pk] is None or better(val, pending_pb[pk]): pending_pb[pk] = val
+                    season = season_of(self.comp_dates.get(str(r.get("comp_id", ""))))
+                    if season is None: continue
+                    sk = (uid, event, season)
+                    if pending_sb.get(sk) is None or better(val, pending_sb[sk]): pending_sb[sk] = val
+            covered = set(history or ())
+            flags = []
+            for r, val in zip(rows, mark_values(rows)):
+                event = str(r.get("event", ""))
+                if val is None:
+                    flags.append("")
+                    continue
+                better = utils.event_info(event).better
+                uid = str(r.get("user_id"))
+                season = season_of(self.comp_dates.get(str(r.get("comp_id", ""))))
+                pk, sk = (uid, event), (uid, event, season)
+                if pk in covered:
+                    pb, sb = pending_pb.get(pk), pending_sb.get(sk)
+                else:
+                    pb = pending_pb.get(pk, self._pb.get(uid, {}).get(event, (None,))[0])
+                    sb = pending_sb.get(sk, self._sb.get(uid, {}).get((event, season), (None,))[0])
+                flag = ""
+                if pb is not None and better(val, pb): flag = "PB"
+                elif season is not None and sb is not None and better(val, sb): flag = "SB"
+                flags.append(flag)
+                if pb is None or better(val, pb): pending_pb[pk] = val
+                if season is not None and (sb is None or better(val, sb)): pending_sb[sk] = val
+            return flags
@@ -0,0 +1,989 @@
+import streamlit as st
+import json
+import os
+import sqlite3
+import threading
+import itertools
+import time
+import zlib
+from dataclasses import dataclass, field
+from types import MappingProxyType
+import gspread
+import requests
+import cache
+import quota
+from gspread.utils import numericise_all, rowcol_to_a1, absolute_range_name
+from google.oauth2.service_account import Credentials
+from google.auth.exceptions import RefreshError
+
+# ==========================================
+# データ保存先 (バックエンド) の切り替え
+# ==========================================
+# - SheetsStorage : Googleスプレッドシート (部員が直接編集する本体)
+# - SQLiteStorage : ローカルの SQLite (読み込みが速い・オフライン/テスト用)
+# どちらも「1行目がヘッダー、2行目以降がデータ」というシートと同じ形で扱う。
+# 行番号もシートと同じ (ヘッダーが1行目、データは2行目から)。
+
+SPREADSHEET_KEY = "156ClxCEF8kOhLIOOqTw_qX1g58sLq9Q5qBYfpF9B5Wg"
+
+# テーブル(ワークシート)名 -> よく検索する列 (SQLite ではインデックスを張る)
+TABLES = {
+    "members": ["user_id"],
+    "competitions": ["comp_id"],
+    "entries": ["comp_id", "user_id"],
+    "results": ["comp_id", "user_id"],
+    "start_list": ["comp_id"],
+    "start_list_catalog": ["comp_id"],
+    "accounting": ["id"],
+    "news": ["id"],
+    "blogs": ["id"],
+}
+
+# テーブルごとの、アプリが書き込む列 (スキーマ)。ensure_header(table) で足りない列を右端に足す。
+# members / competitions は古いシートで列の並びが違うことがあるので、並びではなく「あるかどうか」を見る
+SCHEMAS = {
+    "members": ["user_id", "image", "bio", "name", "role", "role_title", "status", "block", "affiliation", "univ_cat", "grad_year", "events", "pbs", "name_kana", "password"],
+    "competitions": ["comp_id", "comp_name", "date", "location", "deadline", "status", "events", "valid_start", "valid_end"],
+    "entries": ["entry_id", "comp_id", "user_id", "user_name", "events", "times", "comment", "timestamp"],
+    # mark_value / mark_status は保存時に result から計算し、record_flag には PB / SB 更新を記録する
+    "results": [
+        "result_id", "comp_id", "user_id", "event",
+        "division", "round", "heat", "lane",
+        "result", "wind", "rank", "comment",
+        "mark_value", "mark_status", "record_flag"
+    ],
+    "start_list_catalog": ["comp_id", "sheet", "version", "updated_at"],
+    "accounting": ["id", "title", "amount", "deadline", "status_map"],
+    "news": ["id", "date", "title", "content"], # 画像や著者は不要
+    "blogs": ["id", "created_at", "title", "content", "author_name", "author_id", "image"],
+}
+
+# 1行を特定する列 (主キー)。書き込み (db._write) はこの列の値で行を探し、
+# 書き込みキューの反映と未反映分の重ね合わせは、どちらもスナップショットの索引 (Snapshot.row_number) で行番号を引く
+PRIMARY_KEYS = {
+    "members": ("user_id",),
+    "results": ("comp_id", "user_id", "event", "round", "heat"),
+    "competitions": ("comp_id",),
+    "entries": ("comp_id", "user_id"),
+    "start_list_catalog": ("comp_id",),
+    "accounting": ("id",),
+    "news": ("id",),
+    "blogs": ("id",),
+}
+
+# 追記 (append) しかしないテーブル。2回目以降の読み込みでは、前回までに読んだ行より
+# 後ろ (末尾) だけを取得する
+APPEND_ONLY_TABLES = ("results",)
+# 追記以外の編集 (途中の行の書き換え) を拾うため、この秒数ごとに全体を読み直す
+# (このアプリ自身が途中の行を書き換えたときは、次の読み込みで全体を読み直す)
+FULL_RELOAD_SEC = 600
+
+# スナップショットを読む前に、スプレッドシートの最終更新時刻 (Drive の modifiedTime) を1回だけ問い合わせ、
+# 前回から変わっていなければ読み込まずに前回のスナップショットを返す (メタデータは数百バイト)。
+# Drive の更新時刻はシートの編集から少し遅れて変わることがあるので、この秒数ごとには必ず読み直す
+# (このアプリ自身が書き込んだ後は、更新時刻を見ずに読み直す)
+UNCHANGED_MAX_SEC = 300
+
+# 大会ごとに別のシート (パーティション) に分けて持つテーブル。
+# 大会 comp_id の行は "<テーブル>_<comp_id>" に入れ、どの大会がどのシートにあるかは
+# 目録 "<テーブル>_catalog" (スナップショットに含める) に記録する。
+# 1大会の読み書きがその大会の大きさだけで済み、保存の失敗が他の大会に及ばない。
+# 目録に無い大会は、分ける前の共有シート (テーブル名そのまま) から読む。
+PARTITIONED_TABLES = ("start_list",)
+
+def partition_name(table, key):
+    return f"{table}_{key}"
+
+def catalog_name(table):
+    return f"{table}_catalog"
+
+# 新しくワークシートを作るときのサイズ (行, 列)
+NEW_SHEET_SIZE = {
+    "competitions": (100, 10),
+    "results": (5000, 15),
+    "start_list": (1000, 20),
+}
+# パーティション (1大会分) のサイズ
+PARTITION_SHEET_SIZE = {
+    "start_list": (300, 20),
+}
+
+def _new_sheet_size(table):
+    if table in NEW_SHEET_SIZE: return NEW_SHEET_SIZE[table]
+    for base, size in PARTITION_SHEET_SIZE.items():
+        if table.startswith(base + "_"): return size
+    return (1000, 10)
+
+
+def as_read(values):
+    """ 書き込む値を、シートから読み戻したときと同じ形 (数値化済み) にする """
+    return numericise_all([_text(v) for v in values])
+
+
+def to_records(values):
+    """ ヘッダー行つきの2次元リストを get_all_records と同じ形 (数値化した辞書のリスト) にする """
+    if not values: return []
+    header = values[0]
+    records = []
+    for row in values[1:]:
+        row = list(row) + [""] * (len(header) - len(row))
+        records.append(dict(zip(header, numericise_all(row[:len(header)]))))
+    return records
+
+
+# ==========================================
+# 読み取り専用の行
+# ==========================================
+# 画面用に作ったデータはプロセス内で1つを全セッションで共有する (呼び出しのたびにコピーしない)。
+# 共有しているものを画面側で書き換えてしまわないよう、行は FrozenRecord (書き換えると TypeError)、
+# リストはタプルにして渡す。書き換えたいときは dict(行) でコピーしてから。
+class FrozenRecord(dict):
+    """ 書き換えできない dict (json.dumps・pandas などには普通の dict として渡せる) """
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("FrozenRecord は書き換えできません (dict(...) でコピーしてください)")
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    update = setdefault = pop = popitem = clear = _readonly
+
+    def __reduce__(self):
+        # pickle / deepcopy は __setitem__ を使わずに作り直す
+        return (FrozenRecord, (dict(self),))
+
+
+def freeze(value):
+    """ 辞書は FrozenRecord、リストはタプルに (入れ子も) """
+    if isinstance(value, FrozenRecord): return value
+    if isinstance(value, dict): return FrozenRecord((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)): return tuple(freeze(v) for v in value)
+    return value
+
+
+# ==========================================
+# スナップショット
+# ==========================================
+_versions = itertools.count(1)
+_generations = itertools.count(1)
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    ある時点の全テーブルの内容 (読み取り専用)。
+    version は取得のたびに増える番号。
+    generations はテーブルごとの世代で、中身が変わったテーブルだけ新しい番号になる。
+    派生データのキャッシュキーには、読むテーブルの世代 (generation) を使う。
+    fetched_at は取得を始めた時刻 (それ以前の書き込みは含まれている)。
+    """
+    tables: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    version: int = 0
+    fetched_at: float = 0.0
+    generations: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    # テーブル -> 先頭に付け足したシート外の行 (アーカイブ) の数。シートの行はその後ろから始まる
+    archived: MappingProxyType = field(default_factory=lambda: MappingProxyType({}))
+    # (テーブル, キーの列) -> キーの値 -> 行番号の索引 (初めて引いたときに作る)
+    _row_index: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    @classmethod
+    def build(cls, tables, fetched_at=None, previous=None, archived=None):
+        """
+        previous (前のスナップショット) と中身が同じテーブルは、その行と世代をそのまま引き継ぐ
+        (行のタプルも同じものになるので、差分で追いつく集計はそのまま使える)
+        """
+        frozen, gens = {}, {}
+        old_tables = previous.tables if previous else {}
+        for t, recs in tables.items():
+            recs = tuple(recs)
+            old = old_tables.get(t)
+            if old is not None and t in previous.generations and (old is recs or old == recs):
+                frozen[t], gens[t] = old, previous.generations[t]
+            else:
+                frozen[t], gens[t] = recs, next(_generations)
+        return cls(MappingProxyType(frozen), next(_versions), fetched_at or time.time(), MappingProxyType(gens), MappingProxyType(dict(archived or {})))
+
+    def sheet_records(self, table):
+        """ テーブルの行のうちシートにあるもの (i 番目がシートの i + 2 行目) """
+        return self.tables.get(table, ())[self.archived.get(table, 0):]
+
+    def generation(self, *tables):
+        """ tables の世代のタプル (そのテーブルから作るデータのキャッシュキー) """
+        return tuple(self.generations.get(t, 0) for t in tables)
+
+    def records(self, table):
+        """ テーブルの行を辞書のリストで返す (呼び出し側で書き換えても元は変わらない) """
+        return [dict(r) for r in self.tables.get(table, ())]
+
+    def row_number(self, table, key, cols=None):
+        """
+        列 cols (省略時は PRIMARY_KEYS) の値が key (タプル) の行のシート上の行番号。無ければ None。
+        行は追記しても前の行の番号は変わらないので、取得後に追記があってもそのまま使える
+        (行がずれる overwrite の後は使えない。Storage.rewritten_at と比べること)。
+        """
+        cols = tuple(cols or PRIMARY_KEYS[table])
+        index = self._row_index.get((table, cols))
+        if index is None:
+            index = {}
+            for i, r in enumerate(self.sheet_records(table)):
+                # 同じキーが複数あれば find_row と同じく先の行
+                index.setdefault(tuple(str(r.get(c, "")) for c in cols), i + 2)
+            self._row_index[(table, cols)] = index
+        return index.get(tuple(str(v) for v in as_read(key)))
+
+
+class Storage:
+    """
+    バックエンド共通のインターフェース。
+    row は 2 始まりのシート行番号、header は列名のリスト。
+    """
+    def get_records(self, table):
+        """ 全データ行を辞書のリストで返す (get_all_records 相当。テーブルが無ければ []) """
+        raise NotImplementedError
+
+    def get_values(self, table):
+        """ ヘッダー行を含む全セルを文字列の2次元リストで返す """
+        raise NotImplementedError
+
+    def get_rows(self, table, rows):
+        """ 行番号 rows の行だけを {行番号: 行の辞書 (get_records と同じ形)} で返す (無い行は入らない) """
+        raise NotImplementedError
+
+    def get_header(self, table):
+        """ 1行目 (無ければ []) """
+        raise NotImplementedError
+
+    def ensure_header(self, table, header=None):
+        """
+        テーブルが無ければ作り、1行目がヘッダーでなければ挿入し、
+        足りない列は右端に追加する。最終的なヘッダーを返す。
+        header を省略すると SCHEMAS[table]。
+        """
+        raise NotImplementedError
+
+    def find_row(self, table, col, value):
+        """ col 列が value と一致する最初の行番号 (無ければ None) """
+        raise NotImplementedError
+
+    def update_row(self, table, row, values):
+        """ row 行を A 列から values で上書き """
+        raise NotImplementedError
+
+    def update_cell(self, table, row, col, value):
+        """ row 行の col 列 (列名) を更新 """
+        raise NotImplementedError
+
+    def update_rows(self, table, rows):
+        """ rows = {行番号: values}。複数行をまとめて A 列から上書き """
+        raise NotImplementedError
+
+    def update_cells(self, table, cells):
+        """ cells = [(行番号, 列名, 値), ...]。指定したセルだけをまとめて上書き """
+        raise NotImplementedError
+
+    def update_columns(self, table, columns):
+        """ columns = {列名: 2行目からの値のリスト}。列ごとにまとめて上書き """
+        raise NotImplementedError
+
+    def append_rows(self, table, rows):
+        """ 末尾に行を追加 """
+        raise NotImplementedError
+
+    def rewritten_at(self, table):
+        """ このプロセスで table の行の位置を変えた (overwrite した) 最後の時刻 """
+        return self._rewritten_at.get(table, 0.0)
+
+    def overwrite(self, table, header, rows):
+        """ テーブルの中身をヘッダー + rows で丸ごと置き換える """
+        raise NotImplementedError
+
+    def get_snapshot(self, tables=None, fresh=False):
+        """
+        指定テーブル (省略時は全部) をまとめて読み込んで Snapshot にする。
+        fresh=True なら「前回から変わっていない」とみなして前回の結果を返すことはしない
+        """
+        started = time.time()
+        return Snapshot.build({t: self.get_records(t) for t in tables or TABLES}, started)
+
+
+# ==========================================
+# Google スプレッドシート
+# ==========================================
+# 認証済みクライアントとスプレッドシートはプロセス全体で1つを使い回す。
+# gspread の HTTPClient は AuthorizedSession (requests.Session) を持っているので、
+# トークンの自動更新と HTTP の keep-alive はそのまま効く。
+@st.cache_resource(show_spinner=False)
+def _open_spreadsheet(key):
+    key_dict = json.loads(st.secrets["gcp_service_account"]["json_content"])
+    scopes = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+    creds = Credentials.from_service_account_info(key_dict, scopes=scopes)
+    # 全てのリクエストを quota のトークンバケットに通す (429 / 5xx は待って再試行)
+    client = gspread.authorize(creds, http_client=quota.HTTPClient)
+    client.set_timeout(30) # 切れた keep-alive 接続で固まらないように
+    return client.open_by_key(key)
+
+
+class SheetsStorage(Storage):
+    def __init__(self, key=SPREADSHEET_KEY):
+        self.key = key
+        # ワークシートのハンドル (タイトル -> Worksheet)。wb.worksheet() は毎回メタデータを取りに行くので、
+        # 一覧を1回だけ取得してキャッシュする
+        self._ws = {}
+        self._lock = threading.Lock()
+        # 差分読み込みの状態 (テーブル -> _Tail)
+        self._tails = {}
+        self._edited_at = {} # テーブル -> 途中の行を書き換えた時刻 (それ以前の差分状態は使わない)
+        self._rewritten_at = {} # テーブル -> 丸ごと書き直した時刻 (行番号がずれる)
+        self._wrote_at = 0.0 # このプロセスが最後に書き込んだ時刻
+        # テーブルの組 -> (読んだときの更新時刻, スナップショット, 読んだ時刻)
+        self._unchanged = {}
+        self._no_modified_time = False
+        # テーブル -> 1行目 (ヘッダー)。全体を読み込むたび・ヘッダーを書き込むたびに更新するので、
+        # 保存のたびに row_values(1) を読まなくてよい
+        self._headers = {}
+        self._fetch_lock = threading.Lock()
+        # 同じシートの同時読み込みは1回にまとめる
+        self._flight = cache.SingleFlight()
+
+    # --- 接続 ---
+    def spreadsheet(self):
+        return _open_spreadsheet(self.key)
+
+    def reset(self):
+        """ 接続とワークシートのキャッシュを破棄する (次回アクセス時に再接続) """
+        _open_spreadsheet.clear()
+        with self._lock:
+            self._ws.clear()
+            self._headers.clear()
+
+    def handle_error(self, e):
+        """ 通信・認証系のエラーなら接続を作り直す """
+        if isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout, RefreshError)):
+            self.reset()
+        elif isinstance(e, gspread.exceptions.APIError):
+            code = e.response.status_code
+            if code in (401, 403): self.reset()
+            elif code in (400, 404):
+                # シートが削除・改名された可能性があるのでハンドルとヘッダーを取り直す
+                with self._lock:
+                    self._ws.clear()
+                    self._headers.clear()
+
+    def _refresh_handles(self, wb):
+        """ ワークシート一覧を取り直す (ロックを持って呼ぶこと) """
+        self._ws.clear()
+        self._headers.clear()
+        for ws in wb.worksheets():
+            self._ws[ws.title] = ws
+
+    def worksheet(self, table, create=False):
+        """ ワークシートのハンドルを返す (キャッシュ済みなら通信なし)。無ければ None """
+        with self._lock:
+            if table in self._ws: return self._ws[table]
+        wb = self.spreadsheet()
+        try:
+            with self._lock:
+                if table not in self._ws:
+                    # 未登録のタイトルなら一覧を取り直す (他で追加された場合に備える)
+                    self._refresh_handles(wb)
+                if table in self._ws: return self._ws[table]
+                if not create: return None
+                rows, cols = _new_sheet_size(table)
+                ws = wb.add_worksheet(table, rows, cols)
+                self._ws[table] = ws
+                return ws
+        except Exception as e:
+            self.handle_error(e)
+            raise
+
+    def titles(self):
+        """ 存在するワークシート名 (一覧は未取得のときだけ読み込む) """
+        wb = self.spreadsheet()
+        try:
+            with self._lock:
+                if not self._ws: self._refresh_handles(wb)
+                return set(self._ws)
+        except Exception as e:
+            self.handle_error(e)
+            raise
+
+    # --- 読み込み ---
+    def get_records(self, table):
+        def fetch():
+            ws = self.worksheet(table)
+            if not ws: return []
+            return ws.get_all_records()
+        # 相乗りした呼び出し同士で同じ辞書を書き換えないようにコピーして返す
+        return [dict(r) for r in self._flight.do(("records", table), fetch)]
+
+    def get_snapshot(self, tables=None, fresh=False):
+        tables = tuple(tables or TABLES)
+        if fresh: return self._flight.do(("snapshot", tables, True), lambda: self._get_snapshot(tables))
+        return self._flight.do(("snapshot", tables), lambda: self._get_snapshot_if_modified(tables))
+
+    def modified_time(self):
+        """ スプレッドシートの最終更新時刻 (Drive API の modifiedTime)。取れなければ None """
+        if self._no_modified_time: return None
+        try:
+            return self.spreadsheet().get_lastUpdateTime()
+        except gspread.exceptions.APIError as e:
+            # Drive API が無効・権限なしなら、以後は問い合わせずに毎回読み込む
+            if e.response.status_code in (403, 404): self._no_modified_time = True
+            print(f"Modified Time Error: {e}")
+            return None
+        except Exception as e:
+            print(f"Modified Time Error: {e}")
+            return None
+
+    def _get_snapshot_if_modified(self, tables):
+        """ 前回読んだ後にスプレッドシートが更新されていなければ、前回のスナップショットをそのまま返す """
+        checked = time.time()
+        modified = self.modified_time()
+        last = self._unchanged.get(tables)
+        if last and modified is not None:
+            last_modified, snap, loaded_at = last
+            if modified == last_modified and loaded_at > self._wrote_at and checked - loaded_at < UNCHANGED_MAX_SEC:
+                return snap
+        snap = self._get_snapshot(tables)
+        # 更新時刻は読み込みの「前」に取ったもの (読み込み中の編集は次の問い合わせで拾う)
+        if modified is not None: self._unchanged[tables] = (modified, snap, checked)
+        return snap
+
+    def _get_snapshot(self, tables):
+        # 存在するシートだけを1回の values:batchGet でまとめて取得する。
+        # APPEND_ONLY_TABLES は前回の続き (末尾の新しい行) だけを取る。
+        tables = list(tables or TABLES)
+        titles = self.titles()
+        existing = [t for t in tables if t in titles]
+        data = {t: [] for t in tables}
+        started = time.time()
+        with self._fetch_lock:
+            for t in list(self._tails):
+                if t not in titles: del self._tails[t]
+            plan = [(t, self._tail_ranges(t)) for t in existing]
+            try:
+                value_ranges = self._batch_get(plan)
+            except gspread.exceptions.APIError as e:
+                if e.response.status_code != 400 or not self._tails: raise
+                # 行が削除されて範囲がシートの外に出た場合など。シートの行数を取り直し、
+                # 外に出たテーブルだけ差分をやめて全体を読み直す
+                plan = self._plan_within_sheets(existing)
+                try:
+                    value_ranges = self._batch_get(plan)
+                except gspread.exceptions.APIError as e:
+                    if e.response.status_code != 400: raise
+                    self._tails.clear()
+                    plan = [(t, None) for t in existing]
+                    value_ranges = self._batch_get(plan)
+
+            reload = []
+            for t, ranges in plan:
+                if ranges is None:
+                    values = value_ranges.pop(0)
+                    self._remember_header(t, values[0] if values else [])
+                    if t in APPEND_ONLY_TABLES: self._tails[t] = _Tail(values, started)
+                    data[t] = to_records(values)
+                    continue
+                header, rows = value_ranges.pop(0), value_ranges.pop(0)
+                tail = self._tails[t]
+                if tail.matches(header, rows[:1]):
+                    tail.extend(rows[1:])
+                    data[t] = tail.records
+                else:
+                    # ヘッダーか最後に読んだ行が変わっている = 途中が編集・削除された
+                    reload.append(t)
+            if reload:
+                plan = [(t, None) for t in reload]
+                for t, values in zip(reload, self._batch_get(plan)):
+                    self._remember_header(t, values[0] if values else [])
+                    self._tails[t] = _Tail(values, started)
+                    data[t] = to_records(values)
+        return Snapshot.build(data, started)
+
+    def _plan_within_sheets(self, tables):
+        """ ワークシートの行数を取り直し、最後に読んだ行がシートの外に出たテーブルは全体を読む計画にする """
+        with self._lock:
+            self._refresh_handles(self.spreadsheet())
+            sizes = {t: ws.row_count for t, ws in self._ws.items()}
+        for t in list(self._tails):
+            if len(self._tails[t].values) > sizes.get(t, 0): del self._tails[t]
+        return [(t, self._tail_ranges(t)) for t in tables]
+
+    def _tail_ranges(self, table):
+        """
+        差分で読めるなら [ヘッダー, 最後に読んだ行から末尾まで] の範囲、全体を読むなら None。
+        最後に読んだ行から始めるので、追記でシートがちょうどの大きさになっていても範囲はシートの中に収まる
+        """
+        tail = self._tails.get(table)
+        if table not in APPEND_ONLY_TABLES or not tail or not tail.header: return None
+        if time.time() - tail.loaded_at > FULL_RELOAD_SEC: return None
+        if tail.loaded_at <= self._edited_at.get(table, 0): return None
+        last_col = rowcol_to_a1(1, len(tail.header)).rstrip("0123456789")
+        n = len(tail.values) # 最後に読んだ行の行番号 (ヘッダーが1行目)
+        return [
+            absolute_range_name(table, f"A1:{last_col}1"),
+            absolute_range_name(table, f"A{n}:{last_col}"),
+        ]
+
+    def _batch_get(self, plan):
+        """ plan の範囲を1回のリクエストで読み、範囲ごとの2次元リストを順に返す """
+        ranges = []
+        for t, tail_ranges in plan:
+            ranges += tail_ranges or [absolute_range_name(t)]
+        if not ranges: return []
+        try:
+            resp = self.spreadsheet().values_batch_get(ranges)
+        except Exception as e:
+            self.handle_error(e)
+            raise
+        return [vr.get("values", []) for vr in resp.get("valueRanges", [])]
+
+    def get_values(self, table):
+        def fetch():
+            ws = self.worksheet(table)
+            if not ws: return []
+            values = ws.get_all_values()
+            self._remember_header(table, values[0] if values else [])
+            return values
+        return [list(r) for r in self._flight.do(("values", table), fetch)]
+
+    def get_rows(self, table, rows):
+        ws = self.worksheet(table)
+        rows = list(rows)
+        if not ws or not rows: return {}
+        header = self._header(ws, table)
+        last_col = rowcol_to_a1(1, len(header)).rstrip("0123456789")
+        # 行ごとの範囲を1回の values:batchGet で読む
+        try:
+            resp = self.spreadsheet().values_batch_get([absolute_range_name(table, f"A{r}:{last_col}{r}") for r in rows])
+        except Exception as e:
+            self.handle_error(e)
+            raise
+        values = [(vr.get("values") or [[]])[0] for vr in resp.get("valueRanges", [])]
+        return dict(zip(rows, to_records([header] + values)))
+
+    # --- ヘッダー ---
+    def _remember_header(self, table, header):
+        header = list(header)
+        while header and header[-1] == "": header.pop()
+        with self._lock:
+            self._headers[table] = header
+
+    def _header(self, ws, table, fresh=False):
+        """ 1行目 (覚えていればシートを読まない。fresh=True なら読み直す) """
+        with self._lock:
+            header = None if fresh else self._headers.get(table)
+        if header is None:
+            header = ws.row_values(1)
+            self._remember_header(table, header)
+        return list(header)
+
+    def get_header(self, table):
+        ws = self.worksheet(table)
+        if not ws: return []
+        return self._header(ws, table)
+
+    def find_row(self, table, col, value):
+        ws = self.worksheet(table)
+        if not ws: return None
+        header = self._header(ws, table)
+        if col not in header: return None
+        cell = ws.find(str(value), in_column=header.index(col) + 1)
+        return cell.row if cell else None
+
+    # --- 書き込み ---
+    def ensure_header(self, table, header=None):
+        header = list(header or SCHEMAS[table])
+        ws = self.worksheet(table, create=True)
+        with self._lock:
+            cached = self._headers.get(table)
+        current = self._header(ws, table)
+        if current and all(c in current for c in header):
+            return current # いつもはここで終わり (通信なし)
+        # 直す必要がありそうなときは、覚えていたヘッダーではなく今のヘッダーで確かめる
+        if cached is not None: current = self._header(ws, table, fresh=True)
+        if not current:
+            self._write_header(ws, 1, header)
+            current = header
+        elif not any(c in current for c in header):
+            # 1行目に列名が1つも無い = ヘッダーなしでデータが入っている場合は、最上段に【挿入】する
+            # (列の並びが違うだけの古いヘッダーは、足りない列を右端に足すだけ)
+            self._write_header(ws, 1, header, insert_row=True)
+            current = header
+        else:
+            missing = [c for c in header if c not in current]
+            if missing:
+                self._write_header(ws, len(current) + 1, missing)
+                current = current + missing
+        self._remember_header(table, current)
+        return current
+
+    def _write_header(self, ws, start_col, names, insert_row=False):
+        """
+        1行目の start_col 列目から names を書く。行の挿入・列の追加が必要ならそれも含めて
+        1回の batchUpdate で行う
+        """
+        grid = {"sheetId": ws.id}
+        reqs = []
+        if insert_row:
+            reqs.append({"insertDimension": {"range": dict(grid, dimension="ROWS", startIndex=0, endIndex=1)}})
+        extra = start_col - 1 + len(names) - ws.col_count
+        if extra > 0:
+            reqs.append({"appendDimension": dict(grid, dimension="COLUMNS", length=extra)})
+        reqs.append({"updateCells": {
+            "start": dict(grid, rowIndex=0, columnIndex=start_col - 1),
+            "rows": [{"values": [{"userEnteredValue": {"stringValue": str(n)}} for n in names]}],
+            "fields": "userEnteredValue",
+        }})
+        ws.spreadsheet.batch_update({"requests": reqs})
+        self._wrote()
+
+    def _wrote(self):
+        """ 書き込んだ後に呼ぶ (次のスナップショットは更新時刻を見ずに読み直す) """
+        self._wrote_at = time.time()
+
+    def _edited(self, table):
+        """ 途中の行を書き換えた (追記専用テーブルの差分読み込みを一度やめる) """
+        self._edited_at[table] = time.time()
+
+    def update_row(self, table, row, values):
+        ws = self.worksheet(table, create=True)
+        self._edited(table)
+        ws.update(values=[list(values)], range_name=f"A{row}")
+        self._wrote()
+
+    def update_rows(self, table, rows):
+        if not rows: return
+        ws = self.worksheet(table, create=True)
+        self._edited(table)
+        # 1回のリクエストでまとめて書き込む
+        ws.batch_update([{"range": f"A{row}", "values": [list(values)]} for row, values in rows.items()])
+        self._wrote()
+
+    def update_cell(self, table, row, col, value):
+        ws = self.worksheet(table, create=True)
+        header = self._header(ws, table)
+        self._edited(table)
+        ws.update_cell(row, header.index(col) + 1, value)
+        self._wrote()
+
+    def update_cells(self, table, cells):
+        if not cells: return
+        ws = self.worksheet(table, create=True)
+        header = self._header(ws, table)
+        self._edited(table)
+        # 変わったセルだけを1回のリクエストで書き込む
+        ws.batch_update([
+            {"range": rowcol_to_a1(row, header.index(col) + 1), "values": [[value]]}
+            for row, col, value in cells
+        ])
+        self._wrote()
+
+    def update_columns(self, table, columns):
+        ws = self.worksheet(table, create=True)
+        self._edited(table)
+        header = self._header(ws, table)
+        data = []
+        for col, vals in columns.items():
+            if not vals: continue
+            letter = rowcol_to_a1(1, header.index(col) + 1).rstrip("0123456789")
+            data.append({"range": f"{letter}2:{letter}{len(vals) + 1}", "values": [[v] for v in vals]})
+        # 複数の列を1回のリクエストで書き込む
+        if data: ws.batch_update(data)
+        self._wrote()
+
+    def append_rows(self, table, rows):
+        if not rows: return
+        ws = self.worksheet(table, create=True)
+        ws.append_rows([list(r) for r in rows])
+        self._wrote()
+
+    def overwrite(self, table, header, rows):
+        ws = self.worksheet(table, create=True)
+        self._edited(table)
+        self._rewritten_at[table] = time.time()
+        ws.clear()
+        if header:
+            ws.update(values=[list(header)] + [list(r) for r in rows])
+        self._remember_header(table, header or [])
+        self._wrote()
+
+
+def _fingerprint(row):
+    """ 行の中身のチェックサム (右端の空セルは無視) """
+    row = list(row)
+    while row and row[-1] == "": row.pop()
+    return zlib.crc32(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+
+
+class _Tail:
+    """ 追記専用テーブルの読み込み済み部分 (差分読み込み用) """
+    def __init__(self, values, loaded_at=None):
+        self.values = [list(r) for r in values] # ヘッダー行を含む
+        self.header = self.values[0] if self.values else []
+        self.records = to_records(self.values)
+        self.loaded_at = loaded_at or time.time() # 読み込みを始めた時刻
+
+    def matches(self, header, anchor):
+        """ ヘッダーと最後に読んだ行が前回と同じなら、それより上は変わっていないとみなす """
+        if not header or _fingerprint(header[0]) != _fingerprint(self.header): return False
+        last = self.values[-1]
+        return bool(anchor) and _fingerprint(anchor[0]) == _fingerprint(last)
+
+    def extend(self, rows):
+        if not rows: return
+        self.values += [list(r) for r in rows]
+        self.records.extend(to_records([self.header] + rows))
+
+
+# ==========================================
+# SQLite
+# ==========================================
+def _q(name):
+    """ SQL の識別子として安全にクォートする (日本語の列名もそのまま使う) """
+    return '"' + str(name).replace('"', '""') + '"'
+
+def _text(v):
+    """ シートに RAW で書いた後に読み戻した値と揃えるため、すべて文字列で保存する """
+    if v is None: return ""
+    return v if isinstance(v, str) else str(v)
+
+
+class SQLiteStorage(Storage):
+    """
+    各テーブルを同名の SQLite テーブルに保存する。
+    _row 列にシートの行番号を持ち、ヘッダー(列順)は _headers テーブルで管理する。
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._rewritten_at = {}
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS _headers (tbl TEXT PRIMARY KEY, header TEXT NOT NULL)")
+
+    def _header(self, table):
+        row = self.conn.execute("SELECT header FROM _headers WHERE tbl = ?", (table,)).fetchone()
+        return json.loads(row[0]) if row else []
+
+    def _set_header(self, table, header):
+        """ テーブルを(無ければ)作成し、足りない列とインデックスを追加する """
+        header = list(header)
+        current = self._header(table)
+        if not current:
+            cols = ", ".join(f"{_q(c)} TEXT DEFAULT ''" for c in header)
+            self.conn.execute(f"CREATE TABLE IF NOT EXISTS {_q(table)} (_row INTEGER PRIMARY KEY, {cols})")
+        else:
+            for c in header:
+                if c not in current:
+                    self.conn.execute(f"ALTER TABLE {_q(table)} ADD COLUMN {_q(c)} TEXT DEFAULT ''")
+        for c in TABLES.get(table, []):
+            if c in header:
+                self.conn.execute(f"CREATE INDEX IF NOT EXISTS {_q(f'idx_{table}_{c}')} ON {_q(table)} ({_q(c)})")
+        self.conn.execute("INSERT OR REPLACE INTO _headers (tbl, header) VALUES (?, ?)", (table, json.dumps(header, ensure_ascii=False)))
+
+    def _rows(self, table, header):
+        cols = ", ".join(_q(c) for c in header)
+        return self.conn.execute(f"SELECT {cols} FROM {_q(table)} ORDER BY _row").fetchall()
+
+    # --- 読み込み ---
+    def get_records(self, table):
+        with self._lock:
+            header = self._header(table)
+            if not header: return []
+            rows = self._rows(table, header)
+        # gspread の get_all_records と同じ数値化ルールで返す
+        return to_records([header] + rows)
+
+    def get_snapshot(self, tables=None, fresh=False):
+        # 1つの読み取りトランザクションで読むので、全テーブルが同じ時点の内容になる (いつも最新)
+        data = {}
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for t in tables or TABLES:
+                    header = self._header(t)
+                    data[t] = to_records([header] + self._rows(t, header)) if header else []
+            finally:
+                self.conn.execute("COMMIT")
+        return Snapshot.build(data)
+
+    def get_values(self, table):
+        with self._lock:
+            header = self._header(table)
+            if not header: return []
+            return [header] + [list(r) for r in self._rows(table, header)]
+
+    def get_rows(self, table, rows):
+        rows = list(rows)
+        with self._lock:
+            header = self._header(table)
+            if not header or not rows: return {}
+            cols = ", ".join(_q(c) for c in header)
+            found = self.conn.execute(
+                f"SELECT _row, {cols} FROM {_q(table)} WHERE _row IN ({', '.join('?' * len(rows))})", rows
+            ).fetchall()
+        return {r[0]: rec for r, rec in zip(found, to_records([header] + [list(r[1:]) for r in found]))}
+
+    def get_header(self, table):
+        with self._lock:
+            return self._header(table)
+
+    def find_row(self, table, col, value):
+        with self._lock:
+            if col not in self._header(table): return None
+            row = self.conn.execute(f"SELECT _row FROM {_q(table)} WHERE {_q(col)} = ? ORDER BY _row LIMIT 1", (_text(value),)).fetchone()
+        return row[0] if row else None
+
+    # --- 書き込み ---
+    def ensure_header(self, table, header=None):
+        header = list(header or SCHEMAS[table])
+        with self._lock:
+            current = self._header(table)
+            merged = current + [c for c in header if c not in current] if current else list(header)
+            if merged != current:
+                self._set_header(table, merged)
+            return merged
+
+    def update_row(self, table, row, values):
+        with self._lock:
+            self._update_row(table, row, values)
+
+    def _update_row(self, table, row, values):
+        header = self._header(table)
+        values = [_text(v) for v in values][:len(header)]
+        cols = header[:len(values)]
+        exists = self.conn.execute(f"SELECT 1 FROM {_q(table)} WHERE _row = ?", (row,)).fetchone()
+        if exists:
+            sets = ", ".join(f"{_q(c)} = ?" for c in cols)
+            self.conn.execute(f"UPDATE {_q(table)} SET {sets} WHERE _row = ?", values + [row])
+        else:
+            self._insert(table, cols, [values], start=row)
+
+    def update_rows(self, table, rows):
+        if not rows: return
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for row, values in rows.items():
+                    self._update_row(table, row, values)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def update_cell(self, table, row, col, value):
+        with self._lock:
+            self.conn.execute(f"UPDATE {_q(table)} SET {_q(col)} = ? WHERE _row = ?", (_text(value), row))
+
+    def update_cells(self, table, cells):
+        if not cells: return
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for row, col, value in cells:
+                    self.conn.execute(f"UPDATE {_q(table)} SET {_q(col)} = ? WHERE _row = ?", (_text(value), row))
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def update_columns(self, table, columns):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for col, vals in columns.items():
+                    self.conn.executemany(
+                        f"UPDATE {_q(table)} SET {_q(col)} = ? WHERE _row = ?",
+                        [(_text(v), i + 2) for i, v in enumerate(vals)])
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def _insert(self, table, header, rows, start=None):
+        if start is None:
+            last = self.conn.execute(f"SELECT MAX(_row) FROM {_q(table)}").fetchone()[0]
+            start = (last or 1) + 1
+        cols = ", ".join(["_row"] + [_q(c) for c in header])
+        marks = ", ".join(["?"] * (len(header) + 1))
+        data = []
+        for i, r in enumerate(rows):
+            vals = [_text(v) for v in r][:len(header)]
+            vals += [""] * (len(header) - len(vals))
+            data.append([start + i] + vals)
+        self.conn.executemany(f"INSERT INTO {_q(table)} ({cols}) VALUES ({marks})", data)
+
+    def append_rows(self, table, rows):
+        if not rows: return
+        with self._lock:
+            header = self._header(table)
+            if not header: raise ValueError(f"{table}: ヘッダーがありません")
+            self.conn.execute("BEGIN")
+            try:
+                self._insert(table, header, rows)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def overwrite(self, table, header, rows):
+        with self._lock:
+            self._rewritten_at[table] = time.time()
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.execute(f"DROP TABLE IF EXISTS {_q(table)}")
+                self.conn.execute("DELETE FROM _headers WHERE tbl = ?", (table,))
+                if header:
+                    self._set_header(table, header)
+                    self._insert(table, list(header), rows, start=2)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+
+# ==========================================
+# 使用するバックエンドの決定
+# ==========================================
+def _config():
+    """
+    secrets.toml の [storage] または環境変数で設定する。
+      [storage]
+      backend = "sqlite"          # "sheets" (既定) / "sqlite"
+      sqlite_path = "tf_fast.db"
+    環境変数 TF_STORAGE / TF_SQLITE_PATH があればそちらを優先。
+    """
+    conf = {}
+    try: conf = dict(st.secrets.get("storage", {}))
+    except Exception: pass # secrets.toml が無い (テスト・CLI) 場合
+    backend = os.environ.get("TF_STORAGE") or conf.get("backend", "sheets")
+    path = os.environ.get("TF_SQLITE_PATH") or conf.get("sqlite_path", "tf_fast.db")
+    return backend, path
+
+def open_storage(backend, path=None):
+    if backend == "sqlite": return SQLiteStorage(path or "tf_fast.db")
+    if backend == "sheets": return SheetsStorage()
+    raise ValueError(f"unknown storage backend: {backend}")
+
+@st.cache_resource(show_spinner=False)
+def get_storage():
+    """ プロセス全体で共有するバックエンド """
+    backend, path = _config()
+    return open_storage(backend, path)
+
+
+def sync(src, dst, tables=None):
+    """ src の各テーブルを dst に丸ごとコピーする。コピーした (テーブル, 行数) のリストを返す """
+    tables = list(tables or TABLES)
+    # 目録をコピーするなら、そこに載っているパーティションも一緒にコピーする
+    for base in PARTITIONED_TABLES:
+        if catalog_name(base) in tables:
+            tables += [str(r.get("sheet")) for r in src.get_records(catalog_name(base)) if r.get("sheet")]
+    done = []
+    for table in tables:
+        values = src.get_values(table)
+        if not values: continue
+        # 右端の空列 (書式だけ残った列など) は落とす
+        header = list(values[0])
+        while header and header[-1] == "": header.pop()
+        if not header: continue
+        rows = [list(r[:len(header)]) for r in values[1:]]
+        dst.overwrite(table, header, rows)
+        done.append((table, len(rows)))
+    return done
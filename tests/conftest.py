@@ -0,0 +1,5 @@
+import os
+import sys
+
+# テストはリポジトリ直下のモジュール (utils など) をそのまま import する
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
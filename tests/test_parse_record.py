@@ -0,0 +1,54 @@
+import math
+import pytest
+import utils
+
+# parse_record_series (まとめて数値化) が parse_record_to_float / normalize_record (1件ずつ) と
+# 同じ値を返すことを確かめる
+CASES = [
+    # 記録なし
+    "DNS", "DNF", "DQ", "NM", "dnf", "UK", "-",
+    # 空欄
+    "", "  ", None, 0,
+    # 秒・分:秒・時:分:秒
+    "0", "10.50", " 10.50 ", 11, 10.5, "+1.2", "1e1",
+    "1:58.32", "2'03\"45", "2’03”45", "1:02:03", "1：58.32",
+    # 距離
+    "6m12", "6ｍ12", "6M12",
+    # 全角数字
+    "１０.５０", "１:５８.３２", "１０．５０",
+    # 風速つき
+    "10.50(+1.2)", "10.50（+1.2）", "10.50 (+1.2)", "6m12(-0.3)", "(+1.2)", "10.5w",
+    # 読めないもの
+    "abc", "1:xx", "1:2:3:4",
+]
+
+
+def _same(scalar, value):
+    if scalar is None or scalar == "": return math.isnan(value)
+    return value == pytest.approx(scalar)
+
+
+@pytest.mark.parametrize("record", CASES)
+def test_series_matches_scalar(record):
+    value = utils.parse_record_series([record]).iloc[0]
+    assert _same(utils.parse_record_to_float(record), value)
+
+
+@pytest.mark.parametrize("record", CASES)
+def test_series_matches_normalize_record(record):
+    mark_value, mark_status = utils.normalize_record(record, "100m")
+    value = utils.parse_record_series([record]).iloc[0]
+    assert _same(mark_value, value)
+    if mark_status in utils.RECORD_STATUSES: assert math.isnan(value)
+
+
+def test_mixed_series():
+    # 書き方の違う行が混ざっていても、行ごとに1件ずつ読んだのと同じ
+    values = utils.parse_record_series(CASES)
+    assert list(values.index) == list(range(len(CASES)))
+    for record, value in zip(CASES, values):
+        assert _same(utils.parse_record_to_float(record), value), record
+
+
+def test_empty_series():
+    assert utils.parse_record_series([]).empty
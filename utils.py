@@ -4,6 +4,10 @@ import re
 import base64
 from PIL import Image
 import io
+import operator
+import unicodedata
+import numpy as np
+import pandas as pd
 
 # --- 📋 定数リスト ---
 BLOCKS_LIST = ["短距離・跳躍・投擲", "中距離", "長距離", "マネージャー"]
@@ -53,11 +57,68 @@ def calculate_grade(grad_year, univ_cat):
 def get_short_grade(grad_year, univ_cat):
     return calculate_grade(grad_year, univ_cat)
 
+# --- 🏃 種目の定義 ---
+# 種目ごとに「大きい方が良いか」「記録の単位」「風の影響を受けるか」と比較関数を持つ。
+# 判定は種目名ごとに1回だけ行い (結果は覚えておく)、記録を比べるたびに文字列を調べない。
+class EventInfo:
+    def __init__(self, name, higher_is_better, unit, wind=False):
+        self.name = name
+        self.higher_is_better = higher_is_better
+        self.unit = unit  # "s" (タイム) / "m" (距離・高さ) / "pt" (混成の得点)
+        self.wind = wind  # 風速が公認記録の条件になる種目か
+        # 比較関数: better(a, b) は a が b より良い記録なら True (同じなら False)
+        self.better = operator.gt if higher_is_better else operator.lt
+
+    def sort_key(self, value):
+        """ 小さいほど良い並び順のキー """
+        return -value if self.higher_is_better else value
+
+def _track(name, wind=False): return EventInfo(name, False, "s", wind)
+def _field(name, wind=False): return EventInfo(name, True, "m", wind)
+
+EVENT_REGISTRY = {e.name: e for e in [
+    _track("100m", wind=True), _track("200m", wind=True), _track("400m"), _track("800m"),
+    _track("1500m"), _track("5000m"), _track("10000m"), _track("ハーフマラソン"), _track("フルマラソン"),
+    _track("110mH", wind=True), _track("400mH"), _track("3000mSC"), _track("4x100mR"), _track("4x400mR"),
+    _field("走高跳"), _field("棒高跳"), _field("走幅跳", wind=True), _field("三段跳", wind=True),
+    _field("砲丸投"), _field("円盤投"), _field("ハンマー投"), _field("やり投"),
+    EventInfo("十種競技", True, "pt"),
+]} # EVENT_OPTIONS の全種目
+
+# 表記ゆれ (全角・半角は自動で揃える)
+EVENT_ALIASES = {
+    "4×100mR": "4x100mR", "4×400mR": "4x400mR", "4X100mR": "4x100mR", "4X400mR": "4x400mR",
+    "4x100mリレー": "4x100mR", "4x400mリレー": "4x400mR",
+    "ハーフ": "ハーフマラソン", "マラソン": "フルマラソン",
+    "走り高跳": "走高跳", "走り幅跳": "走幅跳", "走り高跳び": "走高跳", "走り幅跳び": "走幅跳",
+    "棒高跳び": "棒高跳", "三段跳び": "三段跳",
+    "砲丸投げ": "砲丸投", "円盤投げ": "円盤投", "ハンマー投げ": "ハンマー投", "やり投げ": "やり投", "槍投": "やり投",
+    "10種競技": "十種競技",
+}
+
+# 登録に無い種目はこの文字を含めば「大きい方が良い」種目とみなす
+_FIELD_KEYWORDS = ["跳", "投", "砲丸", "円盤", "やり", "ハンマー", "ジャベリックス"]
+_POINT_KEYWORDS = ["得点", "競技"]
+_event_cache = {}
+
+def event_info(event_name):
+    """ 種目名 -> EventInfo (登録外の種目は名前から推定) """
+    name = str(event_name)
+    info = _event_cache.get(name)
+    if info is None:
+        key = unicodedata.normalize("NFKC", name).strip()
+        key = EVENT_ALIASES.get(key, key)
+        info = EVENT_REGISTRY.get(key)
+        if info is None:
+            if any(k in key for k in _POINT_KEYWORDS): info = EventInfo(key, True, "pt")
+            elif any(k in key for k in _FIELD_KEYWORDS): info = EventInfo(key, True, "m")
+            else: info = EventInfo(key, False, "s")
+        _event_cache[name] = info
+    return info
+
 def is_track_event(event_name):
-    field_keywords = ["跳", "投", "得点", "競技"] 
-    for k in field_keywords:
-        if k in event_name: return False
-    return True
+    """ 小さい方が良い (タイムを競う) 種目か """
+    return not event_info(event_name).higher_is_better
 
 def parse_record_to_float(record_str):
     if not record_str: return None
@@ -76,37 +137,93 @@ def parse_record_to_float(record_str):
         else: return float(s)
     except: return None
 
+# --- 記録の一括数値化 (pandas の Series 用) ---
+# parse_record_to_float と同じ結果を、1行ずつ呼ばずにまとめて計算する (読めないものは NaN)。
+# 普通の書き方 (10.50 / 1:58.32 / 2'03"45 / 6m12 など) は文字列操作をまとめてかけて分解し、
+# それ以外の珍しい書き方だけ parse_record_to_float に任せる。
+_RECORD_STATUS = ["DNS", "DNF", "DQ", "NM", "UK", "-", ""]
+# (パターンは文字列のまま渡す。コンパイル済みだと pandas が1行ずつ処理してしまう)
+_RE_TO_DOT = r'[mMｍ"”]'
+_RE_TO_COLON = r"['’：]"
+_RE_PAREN = r'\(.*?\)'
+_RE_PAREN_JA = r'（.*?）'
+_RE_NUM = r'[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][+-]?[0-9]+)?'
+
+def parse_record_series(records):
+    """ 記録の Series -> 秒 (トラック) / m (フィールド) の float の Series """
+    obj = pd.Series(records, dtype=object)
+    out = pd.Series(np.nan, index=obj.index, dtype=float)
+    if obj.empty: return out
+    s = obj[obj.astype(bool)].astype(str).str.strip() # 空文字・None・0 は読めない扱い
+    s = s[~s.str.upper().isin(_RECORD_STATUS)]
+    paren = s.str.contains("(", regex=False) | s.str.contains("（", regex=False)
+    if paren.any():
+        s[paren] = s[paren].str.replace(_RE_PAREN, '', regex=True).str.replace(_RE_PAREN_JA, '', regex=True)
+    s = s.str.replace(_RE_TO_DOT, '.', regex=True).str.replace(_RE_TO_COLON, ':', regex=True)
+
+    # "時:分:秒" の区切りの数ごとに、各部分が素直な数値なら一括で変換する
+    n = s.str.count(":")
+    done = []
+    for k, weights in ((0, [1]), (1, [60, 1]), (2, [3600, 60, 1])):
+        part = s[n == k]
+        if part.empty: continue
+        cols = [part] if k == 0 else [part.str.replace(r':.*$', '', regex=True)]
+        if k == 2: cols.append(part.str.replace(r'^[^:]*:|:[^:]*$', '', regex=True))
+        if k > 0: cols.append(part.str.replace(r'^.*:', '', regex=True))
+        ok = cols[0].str.fullmatch(_RE_NUM)
+        for c in cols[1:]: ok &= c.str.fullmatch(_RE_NUM)
+        if not ok.any(): continue
+        val = cols[0][ok].astype(float) * weights[0]
+        for c, w in zip(cols[1:], weights[1:]):
+            val = val + c[ok].astype(float) * w
+        out[val.index] = val.to_numpy()
+        done.append(val.index)
+
+    rest = s.index.difference(done[0].append(done[1:])) if done else s.index
+    if len(rest): out[rest] = np.array([parse_record_to_float(v) for v in obj[rest]], dtype=float)
+    return out
+
+# --- 保存用の記録の正規化 ---
+# results には記録の文字列 (result) と一緒に、数値化した mark_value と
+# 単位 or 記録なしの区分 (mark_status) を保存しておき、読む側では解析しない。
+RECORD_STATUSES = ["DNS", "DNF", "DQ", "NM"]
+
+def record_unit(event_name):
+    """ 記録の単位: "s" (タイム) / "m" (距離・高さ) / "pt" (混成の得点) """
+    return event_info(event_name).unit
+
+def normalize_record(record_str, event_name):
+    """
+    記録 -> (mark_value, mark_status)。
+    読める記録なら (数値, 単位)、DNS などなら ("", "DNS")、読めなければ ("", "")
+    """
+    status = str(record_str or "").strip().upper()
+    if status in RECORD_STATUSES: return "", status
+    val = parse_record_to_float(record_str)
+    if val is None: return "", ""
+    return val, record_unit(str(event_name))
+
 def get_better_record(val1_str, val2_str, event_name):
     v1 = parse_record_to_float(val1_str)
     v2 = parse_record_to_float(val2_str)
     if v1 is None and v2 is None: return "-"
     if v1 is None: return val2_str
     if v2 is None: return val1_str
-    is_track = is_track_event(event_name)
-    if is_track: return val1_str if v1 <= v2 else val2_str
-    else: return val1_str if v1 >= v2 else val2_str
+    return val2_str if event_info(event_name).better(v2, v1) else val1_str
 
 def find_best_result(results_list, event_name):
     if not results_list: return None
-    is_track = is_track_event(event_name)
+    better = event_info(event_name).better
     best_record = None
     best_val = None
     for r in results_list:
-        val_str = r.get("result", "")
-        val_float = parse_record_to_float(val_str)
+        val_float = r.get("mark_value")
+        if not isinstance(val_float, (int, float)) or isinstance(val_float, bool):
+            val_float = parse_record_to_float(r.get("result", ""))
         if val_float is None: continue
-        if best_val is None:
+        if best_val is None or better(val_float, best_val):
             best_val = val_float
             best_record = r
-            continue
-        if is_track:
-            if val_float < best_val:
-                best_val = val_float
-                best_record = r
-        else:
-            if val_float > best_val:
-                best_val = val_float
-                best_record = r
     return best_record
 
 def process_image_to_base64(uploaded_file):
@@ -120,6 +237,18 @@ def process_image_to_base64(uploaded_file):
         return f"data:image/jpeg;base64,{img_str}"
     except: return None
 
+def editor_changes(key):
+    """
+    st.data_editor (key) の変更分。
+    {"edited_rows": {行: {列: 値}}, "added_rows": [{列: 値}], "deleted_rows": [行]} (行は編集前の位置)
+    """
+    state = st.session_state.get(key) or {}
+    return {
+        "edited_rows": {int(i): dict(v) for i, v in (state.get("edited_rows") or {}).items()},
+        "added_rows": [dict(r) for r in (state.get("added_rows") or [])],
+        "deleted_rows": [int(i) for i in (state.get("deleted_rows") or [])],
+    }
+
 # --- CSS デザイン ---
 def apply_custom_css():
     st.markdown("""
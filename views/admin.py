@@ -49,8 +49,7 @@ def page_competition_reg():
 def page_result_registration():
     st.title("⏱️ 結果登録 & 連携")
     
-    comps = db.load_competitions()
-    comps.sort(key=lambda x: x["date"], reverse=True)
+    comps = sorted(db.load_competitions(), key=lambda x: x["date"], reverse=True)
     comp_opts = {f"{c['date']} {c['name']}": c for c in comps}
     
     sel = st.selectbox("大会を選択", list(comp_opts.keys()))
@@ -80,6 +79,7 @@ def page_result_registration():
                     uid = str(e["user_id"])
                     u_info = users_db.get(uid, {})
                     u_pbs = u_info.get("pbs", {})
+                    db_pbs = db.load_personal_bests(uid)
                     try: evs = json.loads(e["events"])
                     except: evs = []
                     try: times = json.loads(e["times"])
@@ -90,19 +90,22 @@ def page_result_registration():
                             "競技始": "", "種目": ev, "組": "", "レーン": "", 
                             "ナンバー": u_info.get("number", ""), 
                             "氏名": e["user_name"], 
-                            "現PB": u_pbs.get(ev, "-"), 
+                            "現PB": utils.get_better_record(u_pbs.get(ev, ""), db_pbs[ev]["result"] if ev in db_pbs else "", ev), 
                             "目標記録": times.get(ev, ""),
                             "所属": u_info.get("affiliation", ""),
                             "招集始": "", "招集終": "", "備考": ""
                         })
                 # データフレーム化してセッションへ
                 st.session_state["editor_sl_data"] = pd.DataFrame(init_data)
+                st.session_state["editor_sl_rows"] = None # DBに無い新しいリスト (全体保存)
                 st.rerun()
         
         # データがある場合 (DBまたはセッション)
         if "editor_sl_data" not in st.session_state:
              if current_sl:
                  st.session_state["editor_sl_data"] = pd.DataFrame(current_sl)
+                 # 各行のシート上の場所 (変更したセルだけを保存するため)
+                 st.session_state["editor_sl_rows"] = db.load_start_list_rows(target_comp["id"])
         
         if "editor_sl_data" in st.session_state:
             df_input = st.session_state["editor_sl_data"]
@@ -124,13 +127,20 @@ def page_result_registration():
             
             col_btn1, col_btn2 = st.columns([1, 2])
             if col_btn1.button("スタートリストを保存", type="primary"):
-                # 辞書リストに変換して保存
-                save_data = edited_df.to_dict(orient="records")
-                if db.save_start_list_overwrite(target_comp["id"], save_data):
-                    st.success("✅ 保存しました！ これでタイムテーブル画面に表示されます。")
+                row_nums = st.session_state.get("editor_sl_rows")
+                if row_nums is not None and row_nums == db.load_start_list_rows(target_comp["id"]):
+                    # DBから読んだリストの編集: 変更したセル・行だけを保存
+                    saved = db.save_start_list_changes(target_comp["id"], row_nums, utils.editor_changes("sl_editor_widget"))
+                else:
+                    # 新規作成・CSV取り込み、または他の人の保存で行の場所が変わった場合は全体を保存
+                    save_data = edited_df.to_dict(orient="records")
+                    saved = db.save_start_list_overwrite(target_comp["id"], save_data)
+                if saved:
+                    # 再読み込みしても消えないトーストで知らせる (待たずにすぐ再読み込みする)
+                    st.toast("保存しました！ これでタイムテーブル画面に表示されます。", icon="✅")
                     # 再読み込み用にキャッシュ更新
                     del st.session_state["editor_sl_data"]
-                    time.sleep(1)
+                    st.session_state.pop("editor_sl_rows", None)
                     st.rerun()
                 else:
                     st.error("保存に失敗しました")
@@ -142,6 +152,7 @@ def page_result_registration():
                     try:
                         df_upload = pd.read_csv(uploaded_csv, encoding="cp932") # ExcelなどからのCSVはcp932が多い
                         st.session_state["editor_sl_data"] = df_upload
+                        st.session_state["editor_sl_rows"] = None
                         st.success("CSVを読み込みました。上の表を確認して「保存」を押してください。")
                         st.rerun()
                     except:
@@ -194,8 +205,11 @@ def page_result_registration():
             edited = st.data_editor(df, key="res_grid_editor", num_rows="dynamic")
             
             if st.button("結果を確定・保存"):
+                # 編集・追加した行だけを保存する (それ以外は DB の内容のまま)
+                changed = set(utils.editor_changes("res_grid_editor")["edited_rows"])
                 save_list = []
-                for _, row in edited.iterrows():
+                for idx, row in edited.iterrows():
+                    if idx in df.index and idx not in changed: continue
                     res_val = str(row.get("結果", "")).strip()
                     if not res_val: continue
                     
@@ -268,8 +282,11 @@ def page_result_registration():
                         lane = r["lane"]
                         pos_str = f"{heat}-{lane}" if heat and lane else "-"
                         
-                        # 備考 (PBなど)
+                        # 備考 (PBなど。保存時に判定した PB / SB も付ける)
                         comment = r["comment"]
+                        flag = r.get("record_flag", "")
+                        if flag and flag not in comment:
+                            comment = f"{comment} {flag}".strip()
                         
                         # 行生成: "1-7 駒野陽高(B4) 10’13″77 PB"
                         line = f"{pos_str} {name}({short_grade}) {res}"
@@ -325,7 +342,7 @@ def page_entry_management():
     comps = db.load_competitions()
     if not comps: st.warning("大会データがありません"); return
 
-    comps.sort(key=lambda x: x['date'], reverse=True)
+    comps = sorted(comps, key=lambda x: x['date'], reverse=True)
     comp_opts = {f"{c['date']} {c['name']}": c for c in comps}
     
     # ★IDから大会情報（名前・日付）を引くための辞書
@@ -356,8 +373,7 @@ def page_entry_management():
             st.warning("ステータスが変わっていません")
         else:
             if db.update_competition_status(target_comp["id"], new_status):
-                st.success(f"ステータスを「{new_status}」に更新しました！")
-                time.sleep(1)
+                st.toast(f"ステータスを「{new_status}」に更新しました！", icon="✅")
                 st.rerun()
             else:
                 st.error("更新に失敗しました")
@@ -511,7 +527,7 @@ def page_migration():
     with tab1:
         st.markdown("### 👤 1名だけ追加登録")
         st.caption("新入部員など、少数の追加はこちらが便利です。")
-        current_users = db.load_users()
+        current_users = dict(db.load_users())
         existing_ids = set(current_users.keys())
         
         def generate_unique_id(ex_ids):
@@ -623,7 +639,7 @@ def page_migration():
                     for uid, u in current_users_dict.items():
                          # load_usersのデータ構造を維持しつつリストへ
                          # ここでは全データ上書き関数を使うため、辞書リストを作る
-                         users_to_save.append(u)
+                         users_to_save.append(dict(u)) # 共有データなのでコピーして書き換える
 
                     # 辞書のリストだと更新が面倒なので、uidをキーにした辞書で管理して最後にリスト化する
                     save_map = {u["user_id"]: u for u in users_to_save}
@@ -887,8 +903,7 @@ def page_accounting_admin():
                         }
                         
                         if db.save_fee_event(new_fee):
-                            st.success(f"「{title}」を作成しました！ (対象: {len(final_targets)}名)")
-                            time.sleep(1)
+                            st.toast(f"「{title}」を作成しました！ (対象: {len(final_targets)}名)", icon="✅")
                             st.rerun()
                         else:
                             st.error("保存失敗")
@@ -938,8 +953,8 @@ def page_accounting_admin():
             else:
                 df = pd.DataFrame(rows)
                 
-                # 編集用データエディタ
-                edited_df = st.data_editor(
+                # 編集用データエディタ (変更は保存時に key から読む)
+                st.data_editor(
                     df[["ステータス", "氏名", "支払状況"]],
                     column_config={
                         "ステータス": st.column_config.CheckboxColumn("支払済", help="チェックすると「済」になります", default=False)
@@ -950,23 +965,14 @@ def page_accounting_admin():
                 )
                 
                 if st.button("変更を保存する", type="primary"):
-                    # 編集結果を元のJSON形式に戻す
-                    new_map = status_map.copy()
-                    
-                    # 名前からUIDを逆引きするのは危険なので、行の順序が変わっていない前提、
-                    # あるいは df のインデックスを使って突合する
-                    # ここではUIDを隠し持てないので、元のrowsの順番通りであると仮定するか、
-                    # data_editorの戻り値には元のindexが維持されるのを利用
-                    
-                    # 一番確実なのは、edited_df の index を見て rows[index] の uid を取ること
-                    for idx, row in edited_df.iterrows():
-                        uid = rows[idx]["uid"]
-                        is_paid = row["ステータス"]
-                        new_map[uid] = "済" if is_paid else "未納"
+                    # チェックを変えた人の分だけを反映する
+                    # (edited_rows の行番号は元の rows の順番と同じなので、rows[idx] の uid を取る)
+                    changed = {}
+                    for idx, vals in utils.editor_changes(f"editor_fee_{target_fee['id']}")["edited_rows"].items():
+                        if "ステータス" in vals:
+                            changed[rows[idx]["uid"]] = "済" if vals["ステータス"] else "未納"
                     
-                    # 保存処理
-                    target_fee["status_map"] = new_map
-                    if db.save_fee_event(target_fee):
-                        st.success("更新しました！")
-                        time.sleep(1)
+                    # 保存処理 (status_map のセルだけを書き換える)
+                    if not changed or db.update_fee_status(target_fee["id"], changed):
+                        st.toast("更新しました！", icon="✅")
                         st.rerun()
\ No newline at end of file
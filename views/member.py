@@ -1,7 +1,6 @@
 import streamlit as st
 import pandas as pd
 import json
-import time
 from datetime import datetime
 import db
 import utils
@@ -26,13 +25,12 @@ def page_top():
     # 自分のエントリーのみ抽出
     my_entries = [e for e in entries if str(e["user_id"]) == str(user["id"])]
     
-    # 既に登録済みのリザルトを取得
-    my_results = db.load_results(None)
+    # 既に登録済みの自分のリザルトを取得
+    my_results = db.load_user_results(user["id"])
     # (comp_id, event) のペア済みセットを作成
     done_keys = set()
     for r in my_results:
-        if str(r.get("user_id")) == str(user["id"]):
-            done_keys.add((str(r["comp_id"]), r["event"]))
+        done_keys.add((str(r["comp_id"]), r["event"]))
     
     # 報告すべきリストを作成
     todo_list = []
@@ -117,9 +115,8 @@ def page_top():
             if st.form_submit_button("入力した結果を登録"):
                 if results_to_submit:
                     if db.save_results_batch(results_to_submit):
-                        st.balloons()
-                        st.success("結果を登録しました！")
-                        time.sleep(1)
+                        # 再読み込みしても消えないトーストで知らせる (待たずにすぐ再読み込みする)
+                        st.toast("結果を登録しました！", icon="🎉")
                         st.rerun()
                 else:
                     st.warning("記録を入力してください")
@@ -220,8 +217,7 @@ def page_account():
         })
         if db.save_user(user["id"], update_data):
             st.session_state.user_info = update_data
-            st.success("基本情報を保存しました")
-            time.sleep(1)
+            st.toast("基本情報を保存しました", icon="✅")
             st.rerun()
 
     st.divider()
@@ -243,11 +239,10 @@ def page_account():
                 img_data = utils.process_image_to_base64(uploaded_file)
                 if img_data: updates["image"] = img_data
             
-            user.update(updates)
+            user = {**user, **updates}
             if db.save_user(user["user_id"], user):
                 st.session_state.user_info = user
-                st.success("更新しました！")
-                time.sleep(1)
+                st.toast("更新しました！", icon="✅")
                 st.rerun()
 
 
@@ -301,8 +296,7 @@ def entry_modal(user, comp, default_data=None):
                 "comment": comment
             }
             if db.save_entry(entry_data):
-                st.success("完了しました！")
-                time.sleep(1)
+                st.toast("完了しました！", icon="✅")
                 st.rerun()
 
 def page_entry_recruitment():
@@ -500,8 +494,7 @@ def page_blog_write():
             }
             
             if db.save_blog(blog_data):
-                st.success("投稿しました！")
-                time.sleep(1)
+                st.toast("投稿しました！", icon="✅")
                 st.rerun()
             else:
                 st.error("投稿エラー")
\ No newline at end of file
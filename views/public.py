@@ -22,7 +22,7 @@ def login_process():
          return
 
     if uid in users and str(users[uid]["password"]) == str(upass):
-        st.session_state.user_info = users[uid]
+        st.session_state.user_info = dict(users[uid]) # 共有データなのでコピーを持つ
     else:
         st.error("IDまたはパスワードが違います")
 
@@ -46,11 +46,11 @@ def show_member_modal(u, users, comps):
     # --- PB情報の詳細表示 ---
     st.subheader("📊 自己ベスト (PB)")
     
-    # DBから全リザルト取得して、この人の分だけ抽出
-    all_results = db.load_results(None)
-    my_results = [r for r in all_results if str(r["user_id"]) == str(u["id"])]
+    # この人のリザルトだけを索引から取得 (日付順・記録は数値化済み)
+    my_results = db.load_user_results(u["id"])
     
     initial_pbs = u.get("pbs", {})
+    univ_pbs = db.load_personal_bests(u["id"]) # 部内の自己ベスト (保存時に更新される表)
     
     if not events:
         st.info("専門種目の登録がありません")
@@ -60,13 +60,7 @@ def show_member_modal(u, users, comps):
             rec_init = initial_pbs.get(ev, "-") # 高校PB
             
             # 大学PB (DB集計)
-            rec_univ = "-"
-            univ_recs = [r["result"] for r in my_results if r["event"] == ev]
-            if univ_recs:
-                best_so_far = univ_recs[0]
-                for r in univ_recs[1:]:
-                    best_so_far = utils.get_better_record(best_so_far, r, ev)
-                rec_univ = best_so_far
+            rec_univ = univ_pbs[ev]["result"] if ev in univ_pbs else "-"
             
             # 表示
             m1, m2, m3 = st.columns([1, 1, 1])
@@ -87,8 +81,7 @@ def show_member_modal(u, users, comps):
         df_my["date"] = pd.to_datetime(df_my["date"], errors="coerce")
         df_my["date"] = df_my["date"].fillna(pd.Timestamp("2000-01-01"))
         
-        # 数値化
-        df_my["record_val"] = df_my["result"].apply(utils.parse_record_to_float)
+        # 数値化済みの記録 (record_val) が読めるものだけ
         df_merged = df_my.dropna(subset=["record_val"])
         
         if not df_merged.empty:
@@ -284,7 +277,7 @@ def page_result():
     with tab1:
         if not comps: st.info("データがありません")
         else:
-            comps.sort(key=lambda x: x['date'], reverse=True)
+            comps = sorted(comps, key=lambda x: x['date'], reverse=True)
             comp_map = {f"{c['date']} {c['name']}": c for c in comps}
             selected_comp_name = st.selectbox("大会を選択", list(comp_map.keys()), key="res_comp_sel")
             target_comp = comp_map[selected_comp_name]
@@ -305,21 +298,17 @@ def page_result():
 
     with tab2:
         st.subheader("種目別ランキング (Top 5)")
-        all_results = db.load_results(None)
-        if not all_results: st.info("データがありません")
+        event_list, season_list = db.load_ranking_options()
+        if not event_list: st.info("データがありません")
         else:
-            df_all = pd.DataFrame(all_results)
-            event_list = sorted(df_all["event"].unique())
-            target_event = st.selectbox("種目を選択", event_list, key="rank_ev_sel")
-            df_rank = df_all[df_all["event"] == target_event].copy()
-            df_rank["record_val"] = df_rank["result"].apply(utils.parse_record_to_float)
-            df_rank = df_rank.dropna(subset=["record_val"])
+            c_ev, c_season, c_pb = st.columns([2, 1, 1])
+            target_event = c_ev.selectbox("種目を選択", event_list, key="rank_ev_sel")
+            season_label = c_season.selectbox("期間", ["通算"] + [f"{y}年度" for y in season_list], key="rank_season_sel")
+            per_athlete = c_pb.checkbox("1人1記録", key="rank_pb_only")
+            season = None if season_label == "通算" else int(season_label[:-2])
             
-            # トラックかフィールドかでソート順を変える
-            is_track = utils.is_track_event(target_event)
-            df_rank = df_rank.sort_values("record_val", ascending=is_track)
-            
-            top5 = df_rank.head(5).reset_index(drop=True)
+            # 書き込み時に更新しているランキングを引くだけ (全リザルトの並べ替えはしない)
+            top5 = pd.DataFrame(db.load_ranking(target_event, season, per_athlete, 5), columns=["user_name", "result", "wind", "comp_id"])
             top5.index += 1
             st.table(top5[["user_name", "result", "wind", "comp_id"]])
 
@@ -343,9 +332,8 @@ def page_result():
                     st.write(f"**所属:** {u_info.get('affiliation','-')} / **学年:** {utils.calculate_grade(u_info.get('grad_year', 2026), u_info.get('univ_cat','学部'))}")
                     st.write(f"**専門:** {', '.join(u_info.get('events',[]))}")
                     
-                    # 全リザルトから本人の分を抽出
-                    all_res = db.load_results(None)
-                    my_res = [r for r in all_res if str(r["user_id"]) == str(target_uid)]
+                    # 本人の分だけを索引から取得
+                    my_res = db.load_user_results(target_uid)
                     
                     if not my_res:
                         st.info("出場記録がありません")
@@ -366,8 +354,7 @@ def page_result():
                             # その種目のデータだけにする
                             df_graph = df_my[df_my["event"] == graph_event].copy()
                             
-                            # 記録を数値化
-                            df_graph["record_val"] = df_graph["result"].apply(utils.parse_record_to_float)
+                            # 記録は数値化済み (record_val)
                             df_graph = df_graph.dropna(subset=["record_val"])
                             
                             if not df_graph.empty:
@@ -0,0 +1,213 @@
+import streamlit as st
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import quota
+
+# ==========================================
+# 書き込みキュー (write-behind)
+# ==========================================
+# save_* はシートに直接書かず、「どの行 (キー) をどう書き換えるか」をローカルの SQLite ファイルに
+# 積んですぐに戻る。裏のスレッドがたまった分をまとめてシートに反映する
+# (同じ行への書き込みは1つにまとめ、テーブルごとにセルの更新1回 + 追記1回)。
+# ファイルに残るので、反映前にアプリが止まっても次に起動したときに続きから書き込む。
+# 反映は「キーで探して、あれば書き換え・無ければ追加」なので、同じ項目を2回反映しても結果は同じ。
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+FLUSH_DELAY = 0.3      # 積まれてから反映するまで待つ秒数 (続けて来る書き込みをまとめる)
+MAX_ATTEMPTS = 8       # これだけ失敗したら諦めて FAILED にする
+MAX_BACKOFF = 60       # 失敗後に次を試すまでの最大秒数
+KEEP_DONE_SEC = 600    # 反映済みの項目を残しておく秒数 (状態表示用)
+
+
+def config(backend):
+    """
+    secrets.toml の [storage] または環境変数で設定する。
+      write_behind = true         # 既定はスプレッドシートのときだけ使う (SQLite はその場で書く)
+      queue_path = "write_queue.db"
+    環境変数 TF_WRITE_BEHIND (1 / 0) / TF_QUEUE_PATH があればそちらを優先。
+    (enabled, path) を返す
+    """
+    conf = {}
+    try: conf = dict(st.secrets.get("storage", {}))
+    except Exception: pass # secrets.toml が無い (テスト・CLI) 場合
+    env = os.environ.get("TF_WRITE_BEHIND")
+    enabled = env not in ("0", "false", "") if env is not None else bool(conf.get("write_behind", backend == "sheets"))
+    path = os.environ.get("TF_QUEUE_PATH") or conf.get("queue_path", "write_queue.db")
+    return enabled, path
+
+
+@dataclass
+class Write:
+    """
+    1行分の書き込み。key (列 -> 値) で行を探し、values (列 -> 値) を書く。
+    mode: "upsert" (あれば書き換え・無ければ追加) / "insert" (無いときだけ追加) / "update" (あるときだけ書き換え)
+    """
+    table: str
+    key: dict
+    values: dict
+    mode: str = "upsert"
+    id: int = None
+    status: str = PENDING
+    attempts: int = 0
+    error: str = ""
+    created_at: float = field(default_factory=time.time)
+    done_at: float = 0.0
+
+
+class WriteQueue:
+    def __init__(self, path, flush):
+        """ flush(writes) はシートに反映し、反映できなかった項目の {id: 理由} を返す (失敗は例外) """
+        self.path = path
+        self.flush_fn = flush
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.generation = 0 # 表示に関わる変化 (追加・失敗) のたびに増える
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS writes ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, key TEXT NOT NULL, vals TEXT NOT NULL,"
+            " mode TEXT NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+            " error TEXT NOT NULL DEFAULT '', created_at REAL NOT NULL, done_at REAL NOT NULL DEFAULT 0)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS writes_status ON writes (status, id)")
+
+    # --- 積む ---
+    def put(self, writes):
+        """ 書き込みを積んで、その id のリストを返す (すぐに戻る) """
+        ids = []
+        with self._lock:
+            self.conn.execute("BEGIN")
+            try:
+                for w in writes:
+                    cur = self.conn.execute(
+                        "INSERT INTO writes (tbl, key, vals, mode, status, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (w.table, json.dumps(w.key, ensure_ascii=False), json.dumps(w.values, ensure_ascii=False),
+                         w.mode, PENDING, w.created_at),
+                    )
+                    w.id = cur.lastrowid
+                    ids.append(w.id)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.generation += 1
+        self.start()
+        return ids
+
+    def retry(self, ids=None):
+        """ FAILED の項目をもう一度試す (ids 省略時は全部) """
+        with self._lock:
+            if ids is None:
+                self.conn.execute("UPDATE writes SET status = ?, attempts = 0 WHERE status = ?", (PENDING, FAILED))
+            else:
+                self.conn.executemany("UPDATE writes SET status = ?, attempts = 0 WHERE id = ? AND status = ?", [(PENDING, i, FAILED) for i in ids])
+            self.generation += 1
+        self.start()
+
+    # --- 読む ---
+    def _select(self, where, args=()):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id, tbl, key, vals, mode, status, attempts, error, created_at, done_at FROM writes"
+                f" WHERE {where} ORDER BY id", args
+            ).fetchall()
+        return [Write(t, json.loads(k), json.loads(v), m, i, s, a, e, c, d) for i, t, k, v, m, s, a, e, c, d in rows]
+
+    def visible(self, since):
+        """ since の時点のシートにはまだ入っていない項目 (未反映 + since より後に反映したもの) """
+        return self._select("status = ? OR (status = ? AND done_at > ?)", (PENDING, DONE, since))
+
+    def pending(self):
+        return self._select("status = ?", (PENDING,))
+
+    def status(self, ids=None):
+        """ 項目の状態 (ids 省略時は反映済みでないもの全部) """
+        if ids is None: return self._select("status != ?", (DONE,))
+        ids = [int(i) for i in ids]
+        if not ids: return []
+        return self._select(f"id IN ({','.join('?' * len(ids))})", ids)
+
+    # --- 反映 ---
+    def start(self):
+        """ 裏の反映スレッドを (動いていなければ) 起動する。前回の残りがあればそれも反映する """
+        with self._lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def _run(self):
+        backoff = 0
+        while True:
+            # 積まれるまで待つ (失敗した後は backoff 秒後にもう一度試す)
+            self._wake.wait(timeout=backoff or None)
+            self._wake.clear()
+            time.sleep(FLUSH_DELAY)
+            try:
+                with quota.background():
+                    self.flush()
+                backoff = 0
+            except Exception:
+                backoff = min(MAX_BACKOFF, max(1, backoff * 2))
+                backoff = quota.backoff(0, backoff) # 複数のプロセスが同時に再試行しないように少しずらす
+
+    def flush(self):
+        """
+        積まれている項目をまとめて反映する (裏のスレッドのほか、テスト・CLI から直接呼んでもよい)。
+        反映した件数を返す。失敗したら試行回数を数えて例外を投げ直す
+        """
+        with self._flush_lock:
+            writes = self.pending()
+            if not writes: return 0
+            try:
+                errors = self.flush_fn(writes)
+            except quota.Throttled:
+                raise # 混んでいるだけなので、試行回数には数えずに待ってやり直す
+            except Exception as e:
+                self._failed(writes, e)
+                raise
+            now = time.time()
+            with self._lock:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "UPDATE writes SET status = ?, done_at = ?, error = '' WHERE id = ?",
+                    [(DONE, now, w.id) for w in writes if w.id not in errors],
+                )
+                self.conn.executemany(
+                    "UPDATE writes SET status = ?, error = ? WHERE id = ?",
+                    [(FAILED, msg, i) for i, msg in errors.items()],
+                )
+                self.conn.execute("DELETE FROM writes WHERE status = ? AND done_at < ?", (DONE, now - KEEP_DONE_SEC))
+                self.conn.execute("COMMIT")
+                if errors: self.generation += 1
+            return len(writes)
+
+    @contextmanager
+    def paused(self):
+        """
+        積まれている分を反映してから、抜けるまで反映を止める (シートを丸ごと書き直す管理コマンド用)。
+        反映できなければ例外を投げ、中は実行しない
+        """
+        with self._flush_lock:
+            self.flush()
+            yield
+
+    def _failed(self, writes, error):
+        with self._lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "UPDATE writes SET attempts = attempts + 1, error = ?,"
+                " status = CASE WHEN attempts + 1 >= ? THEN ? ELSE status END WHERE id = ?",
+                [(str(error), MAX_ATTEMPTS, FAILED, w.id) for w in writes],
+            )
+            self.conn.execute("COMMIT")
+            self.generation += 1